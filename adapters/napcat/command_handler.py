@@ -1,4 +1,5 @@
 import os
+import sys
 import asyncio
 
 from config import config
@@ -9,13 +10,37 @@ from security.whitelist import add_whitelist, remove_whitelist
 from adapters.base import AbstractAdapter
 import core.role_manager as role_manager
 from . import friend_manager as friend_manager
-from .friend_manager import FRIEND_LIST
 from typing import Dict, Any
 
 # 角色添加状态跟踪
 # key: (user_id: str, chat_id: str), value: Dict[str, Any] (e.g., {'state': 'awaiting_prompt', 'type': 'private'})
 user_add_role_state: Dict[tuple[str, str], Dict[str, Any]] = {}
 
+# 命令关键字常量，使用 sys.intern 驻留，使比较可以走身份判断的快速路径
+_KW_ADD = sys.intern("add")
+_KW_REMOVE = sys.intern("remove")
+_KW_MSG = sys.intern("msg")
+_KW_GROUP = sys.intern("group")
+_KW_WHITE = sys.intern("white")
+_KW_BLACK = sys.intern("black")
+_KW_PENDING = sys.intern("pending")
+_KW_APPROVE = sys.intern("approve")
+_KW_REJECT = sys.intern("reject")
+_KW_LIST = sys.intern("list")
+_KW_EDIT = sys.intern("edit")
+_KW_DELETE = sys.intern("delete")
+_KW_ON = sys.intern("on")
+_KW_OFF = sys.intern("off")
+
+_ROLE_ADMIN_SUB_COMMANDS = frozenset((_KW_PENDING, _KW_APPROVE, _KW_REJECT))
+_LIST_MODES = frozenset((_KW_WHITE, _KW_BLACK))
+_SWITCH_MODES = frozenset((_KW_ON, _KW_OFF))
+
+
+def _keyword(token: str) -> str:
+    """将命令参数转为小写并驻留，便于与关键字常量比较。"""
+    return sys.intern(token.lower())
+
 async def send_reply(msg_dict, reply: str, sender: AbstractAdapter):
     """
     根据消息类型构造回复 payload 并发送回复消息。
@@ -54,9 +79,9 @@ async def process_command(msg_dict, sender: AbstractAdapter):
         return await process_role_friend_only_command(msg_dict, sender)
     elif text.startswith("/role"):
         tokens = text.split()
-        sub_command = tokens[1].lower() if len(tokens) > 1 else "list"
+        sub_command = _keyword(tokens[1]) if len(tokens) > 1 else _KW_LIST
         # 检查是否是管理员命令
-        if sub_command in ["pending", "approve", "reject"]:
+        if sub_command in _ROLE_ADMIN_SUB_COMMANDS:
             return await process_role_admin_command(msg_dict, sender)
         else:
             # 普通用户的 /role 命令
@@ -171,30 +196,31 @@ async def process_listmod_command(msg_dict, sender: AbstractAdapter):
     # tokens[2] 为目标号码
     # tokens[3] 为类型标识，要求为 msg 或 group
     target_id = tokens[2].strip()
-    list_type = tokens[3].lower()
+    action = _keyword(tokens[1])
+    list_type = _keyword(tokens[3])
 
     # 根据命令分支和名单类型选择处理逻辑：
     if text.startswith("/arcblack"):
-        if tokens[1].lower() == "add":
-            if list_type == "msg":
+        if action == _KW_ADD:
+            if list_type == _KW_MSG:
                 if add_blacklist(target_id, is_group=False):
                     reply = f"QQ号 {target_id} 已成功加入用户黑名单。"
                 else:
                     reply = f"QQ号 {target_id} 已在用户黑名单中。"
-            elif list_type == "group":
+            elif list_type == _KW_GROUP:
                 if add_blacklist(target_id, is_group=True):
                     reply = f"群号 {target_id} 已成功加入群聊黑名单。"
                 else:
                     reply = f"群号 {target_id} 已在群聊黑名单中。"
             else:
                 reply = "名单类型错误，请使用 msg 或 group。"
-        elif tokens[1].lower() == "remove":
-            if list_type == "msg":
+        elif action == _KW_REMOVE:
+            if list_type == _KW_MSG:
                 if remove_blacklist(target_id, is_group=False):
                     reply = f"QQ号 {target_id} 已从用户黑名单中移除。"
                 else:
                     reply = f"QQ号 {target_id} 不在用户黑名单中。"
-            elif list_type == "group":
+            elif list_type == _KW_GROUP:
                 if remove_blacklist(target_id, is_group=True):
                     reply = f"群号 {target_id} 已从群聊黑名单中移除。"
                 else:
@@ -205,26 +231,26 @@ async def process_listmod_command(msg_dict, sender: AbstractAdapter):
             reply = "无效的命令操作，请使用 add 或 remove。"
 
     elif text.startswith("/arcwhite"):
-        if tokens[1].lower() == "add":
-            if list_type == "msg":
+        if action == _KW_ADD:
+            if list_type == _KW_MSG:
                 if add_whitelist(target_id, is_group=False):
                     reply = f"QQ号 {target_id} 已成功加入用户白名单。"
                 else:
                     reply = f"QQ号 {target_id} 已在用户白名单中。"
-            elif list_type == "group":
+            elif list_type == _KW_GROUP:
                 if add_whitelist(target_id, is_group=True):
                     reply = f"群号 {target_id} 已成功加入群聊白名单。"
                 else:
                     reply = f"群号 {target_id} 已在群聊白名单中。"
             else:
                 reply = "名单类型错误，请使用 msg 或 group。"
-        elif tokens[1].lower() == "remove":
-            if list_type == "msg":
+        elif action == _KW_REMOVE:
+            if list_type == _KW_MSG:
                 if remove_whitelist(target_id, is_group=False):
                     reply = f"QQ号 {target_id} 已从用户白名单中移除。"
                 else:
                     reply = f"QQ号 {target_id} 不在用户白名单中。"
-            elif list_type == "group":
+            elif list_type == _KW_GROUP:
                 if remove_whitelist(target_id, is_group=True):
                     reply = f"群号 {target_id} 已从群聊白名单中移除。"
                 else:
@@ -250,10 +276,10 @@ async def process_msg_list_command(msg_dict, sender: AbstractAdapter):
     """
     text = extract_text_from_message(msg_dict)
     tokens = text.split()
-    if len(tokens) < 2 or tokens[1].lower() not in ("white", "black"):
+    if len(tokens) < 2 or _keyword(tokens[1]) not in _LIST_MODES:
         reply = "命令格式错误，请使用：/arcqqlist [white/black]"
     else:
-        new_mode = tokens[1].lower()
+        new_mode = _keyword(tokens[1])
         # 修改用户消息名单模式配置，并保存到配置文件
         config["qqbot"]["qq_list_mode"] = new_mode
         config.save()
@@ -272,10 +298,10 @@ async def process_group_list_command(msg_dict, sender: AbstractAdapter):
     """
     text = extract_text_from_message(msg_dict)
     tokens = text.split()
-    if len(tokens) < 2 or tokens[1].lower() not in ("white", "black"):
+    if len(tokens) < 2 or _keyword(tokens[1]) not in _LIST_MODES:
         reply = "命令格式错误，请使用：/arcgrouplist [white/black]"
     else:
-        new_mode = tokens[1].lower()
+        new_mode = _keyword(tokens[1])
         # 修改群聊名单模式配置，并保存到配置文件
         config["qqbot"]["group_list_mode"] = new_mode
         config.save()
@@ -291,7 +317,8 @@ async def process_role_command(msg_dict, sender: AbstractAdapter):
     
     # 检查好友权限
     role_friends_only = config.get("qqbot", {}).get("role_friends_only", False)
-    if role_friends_only and sender_qq not in FRIEND_LIST:
+    # 通过模块属性读取，确保拿到刷新后的好友集合
+    if role_friends_only and sender_qq not in friend_manager.FRIEND_SET:
         admin_qq_list = config.get("qqbot", {}).get("admin_qq", [])
         if sender_qq not in admin_qq_list:
             await send_reply(msg_dict, "这个功能只对已经添加我为好友的用户开放喵。", sender)
@@ -306,11 +333,11 @@ async def process_role_command(msg_dict, sender: AbstractAdapter):
     chat_id = str(msg_dict.get("group_id") if message_type == "group" else user_id)
 
     tokens = text.split()
-    sub_command = tokens[1].lower() if len(tokens) > 1 else "list" # 默认为 list
+    sub_command = _keyword(tokens[1]) if len(tokens) > 1 else _KW_LIST # 默认为 list
 
     reply = ""
 
-    if sub_command == "add":
+    if sub_command == _KW_ADD:
         # 开始添加角色流程
         state_key = (user_id, chat_id)
         user_add_role_state[state_key] = {
@@ -320,7 +347,7 @@ async def process_role_command(msg_dict, sender: AbstractAdapter):
         reply = "请输入角色 Prompt喵："
         print(f"[DEBUG] User {user_id} in chat {chat_id} started adding role. State: {user_add_role_state[state_key]}")
 
-    elif sub_command == "edit":
+    elif sub_command == _KW_EDIT:
         if len(tokens) < 3:
             reply = "请指定要编辑的角色名称：/role edit <角色名称>"
         else:
@@ -340,7 +367,7 @@ async def process_role_command(msg_dict, sender: AbstractAdapter):
                 reply = f"请输入 '{role_name_to_edit}' 的新 Prompt喵："
                 print(f"[DEBUG] User {user_id} in chat {chat_id} started editing role '{role_name_to_edit}'. State: {user_add_role_state[state_key]}")
 
-    elif sub_command == "delete":
+    elif sub_command == _KW_DELETE:
         if len(tokens) < 3:
             reply = "请指定要删除的角色名称：/role delete <角色名称>"
         else:
@@ -350,7 +377,7 @@ async def process_role_command(msg_dict, sender: AbstractAdapter):
             else:
                 reply = f"删除角色模板 '{role_name_to_delete}' 失败（可能是名称不存在喵？）。"
 
-    elif sub_command == "list":
+    elif sub_command == _KW_LIST:
         # 显示角色列表
         role_names = role_manager.get_role_names()
         if not role_names:
@@ -394,10 +421,10 @@ async def process_role_admin_command(msg_dict, sender: AbstractAdapter):
         await send_reply(msg_dict, "无效的管理命令。请使用 /role pending, /role approve <ID>, 或 /role reject <ID>", sender)
         return True
 
-    admin_sub_command = tokens[1].lower()
+    admin_sub_command = _keyword(tokens[1])
     reply = ""
 
-    if admin_sub_command == "pending":
+    if admin_sub_command == _KW_PENDING:
         pending_roles = role_manager.list_pending_roles()
         if not pending_roles:
             reply = "当前没有待审核的角色模板。"
@@ -407,7 +434,7 @@ async def process_role_admin_command(msg_dict, sender: AbstractAdapter):
                 reply += f"- ID: {pid}\n  名称: {info.get('name', '?')}\n  申请人: {info.get('requester_user_id', '?')}\n  来源: {info.get('requester_chat_type', '?')} {info.get('requester_chat_id', '?')}\n  (Prompt 预览: {info.get('prompt', '')[:30]}...)\n"
             reply += "\n使用 /role approve <ID> 或 /role reject <ID> 处理。"
 
-    elif admin_sub_command == "approve":
+    elif admin_sub_command == _KW_APPROVE:
         if len(tokens) < 3:
             reply = "请提供要批准的审核 ID: /role approve <审核ID>"
         else:
@@ -431,7 +458,7 @@ async def process_role_admin_command(msg_dict, sender: AbstractAdapter):
             else:
                 reply = f"批准失败：找不到审核 ID '{pending_id_to_approve}' 或处理出错。"
 
-    elif admin_sub_command == "reject":
+    elif admin_sub_command == _KW_REJECT:
         if len(tokens) < 3:
             reply = "请提供要拒绝的审核 ID: /role reject <审核ID>"
         else:
@@ -486,10 +513,10 @@ async def process_role_friend_only_command(msg_dict, sender: AbstractAdapter):
 
     text = extract_text_from_message(msg_dict)
     tokens = text.split()
-    if len(tokens) < 2 or tokens[1].lower() not in ("on", "off"):
+    if len(tokens) < 2 or _keyword(tokens[1]) not in _SWITCH_MODES:
         reply = "命令格式错误，请使用：/rolefriendonly [on/off]"
     else:
-        new_mode = tokens[1].lower() == "on"
+        new_mode = _keyword(tokens[1]) == _KW_ON
         # 确保 qqbot 部分存在
         if "qqbot" not in config:
             config["qqbot"] = {}
@@ -1,14 +1,16 @@
 import asyncio
 import time
 import random
-from typing import Optional, List, Dict, Tuple
+from typing import Optional, List, Dict, FrozenSet
 from logger import log
 
 # 全局好友列表缓存
 FRIEND_LIST: List[str] = []
+# 好友 user_id 集合快照，用于 O(1) 的成员判断
+FRIEND_SET: FrozenSet[str] = frozenset()
 # 待处理的好友列表请求
-# key: echo, value: (asyncio.Event, list_to_hold_result)
-pending_friend_list_requests: Dict[str, Tuple[asyncio.Event, List]] = {}
+# key: echo, value: 等待响应数据的 asyncio.Future
+pending_friend_list_requests: Dict[str, asyncio.Future] = {}
 # 用于发送消息的 sender 实例
 _sender_instance = None
 
@@ -24,16 +26,14 @@ async def get_friend_list(timeout: float = 10.0) -> Optional[List[str]]:
     :param timeout: 等待响应的超时时间。
     :return: 好友的 user_id 列表，或者在失败/超时时返回 None。
     """
-    global FRIEND_LIST, pending_friend_list_requests, _sender_instance
+    global FRIEND_LIST, FRIEND_SET
     if not _sender_instance:
         log.error("FriendManager: Sender 未设置，无法获取好友列表。")
         return None
 
     echo = f"get_friend_list_{time.time()}_{random.randint(0, 100000)}"
-    event = asyncio.Event()
-    result_holder = []
-    
-    pending_friend_list_requests[echo] = (event, result_holder)
+    future = asyncio.get_running_loop().create_future()
+    pending_friend_list_requests[echo] = future
     
     request_data = {
         "action": "get_friend_list",
@@ -44,12 +44,12 @@ async def get_friend_list(timeout: float = 10.0) -> Optional[List[str]]:
     try:
         await _sender_instance.send_json(request_data)
         
-        await asyncio.wait_for(event.wait(), timeout=timeout)
+        friends = await asyncio.wait_for(future, timeout=timeout)
         
-        if result_holder:
-            friends = result_holder[0]
+        if friends is not None:
             # 更新全局缓存
-            FRIEND_LIST = [str(friend['user_id']) for friend in friends]
+            friend_ids = [uid for friend in friends if (uid := str(friend.get('user_id') or ''))]
+            FRIEND_LIST, FRIEND_SET = friend_ids, frozenset(friend_ids)
             log.info(f"好友列表已更新，共 {len(FRIEND_LIST)} 位好友。")
             return FRIEND_LIST
         else:
@@ -62,14 +62,12 @@ async def get_friend_list(timeout: float = 10.0) -> Optional[List[str]]:
         log.error(f"获取好友列表时发生未知错误: {e}", exc_info=True)
         return None
     finally:
-        if echo in pending_friend_list_requests:
-            del pending_friend_list_requests[echo]
+        pending_friend_list_requests.pop(echo, None)
 
 def handle_friend_list_response(echo: str, data: List[Dict]):
     """
     处理 get_friend_list 的 websocket 响应。
     """
-    if echo in pending_friend_list_requests:
-        event, result_holder = pending_friend_list_requests[echo]
-        result_holder.append(data)
-        event.set()
+    future = pending_friend_list_requests.pop(echo, None)
+    if future is not None and not future.done():
+        future.set_result(data)
@@ -1,8 +1,10 @@
 import json
 import asyncio
+import logging
 from abc import ABC, abstractmethod
 from typing import Union, List, Optional
 from .message_types import MessageSegment
+from common.json_utils import json_dumps
 from logger import log
 
 class IMessageSender(ABC):
@@ -40,16 +42,18 @@ class WebSocketSender(IMessageSender):
         self._websocket = websocket
 
     async def _send(self, payload: dict):
-        log.info(f"🚀 WebSocketSender._send 被调用，payload action: {payload.get('action')}")
+        action = payload.get('action')
+        log.debug("🚀 WebSocketSender._send 被调用，payload action: %s", action)
         if not self._websocket:
             log.error("❌ WebSocket is not connected, cannot send message.")
             return
         try:
-            # 使用 pretty print 格式化日志输出
-            pretty_payload = json.dumps(payload, indent=2, ensure_ascii=False)
-            log.info(f"📤 即将发送WebSocket消息:\n{pretty_payload}")
-            await self._websocket.send(json.dumps(payload))
-            log.info(f"✅ WebSocket消息发送成功: {payload.get('action')}")
+            # 仅在 DEBUG 级别下才用 pretty print 格式化完整 payload
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("📤 即将发送WebSocket消息:\n%s", json.dumps(payload, indent=2, ensure_ascii=False))
+            # 以文本帧发送，orjson 输出的 bytes 需解码为 str
+            await self._websocket.send(json_dumps(payload).decode("utf-8"))
+            log.debug("✅ WebSocket消息发送成功: %s", action)
         except Exception as e:
             log.error(f"Failed to send message via WebSocket: {e}", exc_info=True)
 
@@ -4,6 +4,9 @@
 
 MessageSegment 是所有消息段类型的联合类型。
 
+注意：这些 TypedDict 只用于静态类型标注，运行时消息段仍是普通 dict，
+构造和访问都没有额外开销；收发消息时不会按这些类型做校验或分派。
+
 完整协议说明放在文件尾部了
 """
 from typing import TypedDict, Literal, Union, List, Optional
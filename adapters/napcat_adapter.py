@@ -2,10 +2,12 @@ import asyncio
 import websockets
 import json
 import time
+import logging
 from typing import List, Any
 from urllib.parse import urlparse, urlunparse, parse_qs, urlencode
 
 from adapters.base import AbstractAdapter
+from common.json_utils import json_loads
 from config import config
 from core.event_bus import event_bus
 from logger import log
@@ -109,7 +111,9 @@ class NapcatAdapter(AbstractAdapter):
     async def _handle_raw_message(self, raw_message: str):
         """处理原始 WebSocket 消息并发布到事件总线。"""
         try:
-            msg = json.loads(raw_message)
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("WebSocket收到消息: %.200s", raw_message)
+            msg = json_loads(raw_message)
 
             # --- API响应处理 ---
             echo_id = msg.get('echo', '')
@@ -171,6 +175,6 @@ class NapcatAdapter(AbstractAdapter):
                 }
             )
         except json.JSONDecodeError:
-            log.warning(f"无法解析收到的 WebSocket 消息: {raw_message}")
+            log.warning("无法解析收到的 WebSocket 消息: %.200s", raw_message)
         except Exception as e:
             log.error(f"处理原始消息时发生错误: {e}", exc_info=True)
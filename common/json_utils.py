@@ -0,0 +1,77 @@
+"""
+JSON 序列化辅助函数
+- 优先使用 orjson（更快、分配更少），未安装时回退到标准库 json
+- 统一以 UTF-8 bytes 作为序列化结果，保留非 ASCII 字符
+"""
+import json
+import mmap
+import os
+from typing import Any, Union
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+
+def json_loads(data: Union[str, bytes]) -> Any:
+    """解析 JSON 字符串或 bytes。解析失败时抛出 json.JSONDecodeError。"""
+    if HAS_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(obj: Any, indent: bool = False) -> bytes:
+    """
+    将对象序列化为 UTF-8 编码的 JSON bytes。
+
+    :param obj: 要序列化的对象。
+    :param indent: 是否以两个空格缩进输出（用于落盘的文件）。
+    """
+    if HAS_ORJSON:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None).encode("utf-8")
+
+
+def load_json_file(path: str, use_mmap: bool = False) -> Any:
+    """
+    以二进制方式读取并解析 JSON 文件。
+
+    :param path: 文件路径。
+    :param use_mmap: 为 True 且安装了 orjson 时，通过内存映射直接从页缓存解析，省去一次整文件拷贝。
+    """
+    with open(path, "rb") as f:
+        if use_mmap and HAS_ORJSON:
+            size = os.fstat(f.fileno()).st_size
+            # 空文件无法映射，交给常规路径抛出解析错误
+            if size > 0:
+                with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+                    view = memoryview(mm)
+                    try:
+                        return orjson.loads(view)
+                    finally:
+                        # 关闭映射前必须先释放视图
+                        view.release()
+        return json_loads(f.read())
+
+
+def write_bytes_atomic(path: str, data: bytes):
+    """先写入同目录下的临时文件，再用 os.replace 原子替换，避免写到一半的文件。"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def dump_json_file(path: str, obj: Any, indent: bool = True, atomic: bool = False):
+    """将对象序列化后以二进制方式写入 JSON 文件。atomic 为 True 时原子替换。"""
+    data = json_dumps(obj, indent=indent)
+    if atomic:
+        write_bytes_atomic(path, data)
+        return
+    with open(path, "wb") as f:
+        f.write(data)
@@ -0,0 +1,22 @@
+"""
+时间格式化辅助函数
+- 聊天记录中的大量消息时间戳集中在少数几秒/几分钟内，按秒缓存格式化结果，
+  避免每条消息都调用 time.localtime 和 time.strftime
+"""
+import time
+from functools import lru_cache
+
+
+@lru_cache(maxsize=4096)
+def _format_second(ts: int, fmt: str) -> str:
+    return time.strftime(fmt, time.localtime(ts))
+
+
+def format_timestamp(ts, fmt: str = "%H:%M:%S") -> str:
+    """
+    将 Unix 时间戳格式化为本地时间字符串。
+
+    :param ts: Unix 时间戳（秒），小数部分会被忽略。
+    :param fmt: time.strftime 格式，只应包含精确到秒的字段。
+    """
+    return _format_second(int(ts), fmt)
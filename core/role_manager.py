@@ -16,6 +16,10 @@ role_switch_flags: Dict[tuple[str, str], bool] = {}
 ROLES_FILE = os.path.join("data", "roles.json")
 PENDING_ROLES_FILE = os.path.join("data", "pending_roles.json")
 
+# 角色文件的内存缓存：只有当文件的 mtime 发生变化时才重新解析 JSON
+# 每条消息都会读取角色（获取角色 Prompt、切换角色等），避免每次都读盘
+_roles_cache: Dict[str, Any] = {"mtime_ns": None, "data": None}
+
 def _ensure_file(file_path: str, default_content: Any = {}):
     """确保 JSON 文件和目录存在"""
     os.makedirs(os.path.dirname(file_path), exist_ok=True)
@@ -46,13 +50,32 @@ def _save_json(file_path: str, data: Any):
     except IOError as e:
         print(f"[ERROR] 保存 JSON 文件失败: {file_path}, Error: {e}")
 
+def _get_roles_mtime_ns() -> Optional[int]:
+    """返回角色文件的 mtime（纳秒），文件不存在时返回 None"""
+    try:
+        return os.stat(ROLES_FILE).st_mtime_ns
+    except OSError:
+        return None
+
 def load_roles() -> Dict[str, str]:
-    """加载所有角色，返回一个 名字->Prompt 的字典"""
-    return _load_json(ROLES_FILE, default_return={})
+    """加载所有角色，返回一个 名字->Prompt 的字典（文件未修改时使用缓存）"""
+    mtime_ns = _get_roles_mtime_ns()
+    if mtime_ns is not None and _roles_cache["data"] is not None and _roles_cache["mtime_ns"] == mtime_ns:
+        # 返回副本，调用方修改后再保存时不会影响缓存
+        return dict(_roles_cache["data"])
+    roles = _load_json(ROLES_FILE, default_return={})
+    # 使用读取前的 mtime：读取期间文件被改写时，缓存的 mtime 与新文件不符，下次会重新读取
+    if mtime_ns is not None:
+        _roles_cache["mtime_ns"] = mtime_ns
+        _roles_cache["data"] = dict(roles)
+    return roles
 
 def save_roles(roles: Dict[str, str]):
-    """保存角色字典到文件"""
+    """保存角色字典到文件，并使内存缓存失效"""
     _save_json(ROLES_FILE, roles)
+    # 以保存后的文件为准；写入失败时 mtime 不变，下次读取仍会得到文件中的旧内容
+    _roles_cache["mtime_ns"] = None
+    _roles_cache["data"] = None
 
 def add_role(name: str, prompt: str) -> bool:
     """添加一个新角色。如果名字已存在则失败。"""
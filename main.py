@@ -9,6 +9,7 @@ from config import config
 from core.event_bus import event_bus
 from core.chat_service import ChatService
 from adapters.base import AbstractAdapter
+from tools import tool_registry
 
 def load_adapter() -> AbstractAdapter:
     """根据配置动态加载并实例化适配器。"""
@@ -65,6 +66,8 @@ async def main():
                 task.cancel()
         
         await asyncio.gather(*tasks, return_exceptions=True)
+        # 关闭工具复用的网络会话
+        await tool_registry.aclose()
         log.info("所有服务已停止，主程序已关闭。")
 
 if __name__ == "__main__":
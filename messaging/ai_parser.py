@@ -1,5 +1,6 @@
 import re
 import asyncio
+import logging
 import aiohttp
 from typing import List, Optional, Tuple, Dict, Any
 
@@ -12,23 +13,52 @@ from logger import log
 
 # --- 预编译的正则表达式 ---
 
+# 标记内容使用 [^\]]* 而不是惰性的 .*?：同样止于第一个 ]（并且可以跨行），但无需逐字符回溯
+
 # 匹配所有静默标记，用于第一轮清理
 SILENT_TAG_PATTERN = re.compile(
-    r"\[(note|setrole|get_context):.*?\]", re.DOTALL
+    r"\[(note|setrole|get_context):[^\]]*\]"
 )
 
 # 匹配所有可见的功能标记
 VISIBLE_TAG_PATTERN = re.compile(
-    r"\[(reply|@qq|CQ:at|music|poke|emoji|longtext):.*?\]", re.DOTALL
+    r"\[(reply|@qq|CQ:at|music|poke|emoji|longtext):[^\]]*\]"
 )
 
+# 笔记删除指令 [note:ID:delete]，ID 必须是数字，允许冒号两侧和首尾有空白；
+# 其他以 ": delete" 结尾的内容仍按普通笔记添加
+NOTE_DELETE_PATTERN = re.compile(r"\s*(\d+)\s*:\s*delete\s*")
+
+# 匹配 [reply] / [reply:消息ID] 标记，可选的消息 ID 在第一个分组中
+REPLY_TAG_PATTERN = re.compile(r"\[reply(?:\s*:\s*(\d+))?\]")
+
+# 标签内容中的连续空白、QQ 号等数字
+WHITESPACE_PATTERN = re.compile(r"\s+")
+DIGITS_PATTERN = re.compile(r"\d+")
+
 # --- 辅助函数 ---
 
 def _clean_tag_content(content: Optional[str]) -> str:
     """清理标签内容中的多余空白。"""
     if content is None:
         return ""
-    return re.sub(r'\s+', ' ', content.strip())
+    return WHITESPACE_PATTERN.sub(' ', content.strip())
+
+def _remove_matches(pattern: re.Pattern, text: str) -> Tuple[List[re.Match], str]:
+    """
+    一次扫描找出 pattern 的所有匹配，同时返回移除这些匹配后的文本（结果与 pattern.sub("", text) 相同）。
+    """
+    matches: List[re.Match] = []
+    parts: List[str] = []
+    last_idx = 0
+    for m in pattern.finditer(text):
+        matches.append(m)
+        parts.append(text[last_idx:m.start()])
+        last_idx = m.end()
+    if not matches:
+        return matches, text
+    parts.append(text[last_idx:])
+    return matches, "".join(parts)
 
 # --- 核心解析逻辑 ---
 
@@ -44,13 +74,20 @@ async def parse_ai_message_to_segments(
     """
     解析AI输出，将结构化标记转为MessageSegment。
     """
-    log.debug(f"AI_Parser: 开始解析AI消息, 传入 active_role_name='{active_role_name}'")
-    log.debug(f"AI_Parser: 原始文本: \"{text}\"")
+    # 每条消息都会经过这里，未开启 DEBUG 时连参数格式化也一并跳过
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("AI_Parser: 开始解析AI消息, 传入 active_role_name='%s'", active_role_name)
+        log.debug("AI_Parser: 原始文本: \"%s\"", text)
 
     if not chat_id:
         log.warning("AI_Parser: chat_id 缺失, 部分功能将禁用。")
         return [{"type": "text", "data": {"text": text}}] if text else []
 
+    # 所有标记都以 [ 开头，绝大多数回复一个都没有：直接得到与完整解析相同的结果，跳过全部正则扫描
+    if "[" not in text:
+        stripped = text.strip()
+        return [{"type": "text", "data": {"text": stripped}}] if stripped else []
+
     # 步骤 1: 处理静默标记
     cleaned_text = await _handle_silent_tags(text, chat_id, chat_type, active_role_name, self_id)
 
@@ -62,7 +99,7 @@ async def parse_ai_message_to_segments(
     segments = await _parse_visible_tags(
         cleaned_text, message_id, chat_id, chat_type, session
     )
-    log.debug(f"AI_Parser: 解析完成, 生成 {len(segments)} 个消息段。")
+    log.debug("AI_Parser: 解析完成, 生成 %s 个消息段。", len(segments))
     return segments
 
 
@@ -72,17 +109,20 @@ async def _handle_silent_tags(text: str, chat_id: str, chat_type: str, active_ro
     """
     # 优先使用传入的角色名，如果未传入，则回退到从 role_manager 获取
     role_for_processing = active_role_name or role_manager.get_active_role(chat_id, chat_type) or DEFAULT_ROLE_KEY
-    log.debug(f"AI_Parser: _handle_silent_tags 使用的角色是: '{role_for_processing}'")
+    log.debug("AI_Parser: _handle_silent_tags 使用的角色是: '%s'", role_for_processing)
 
-    for m in SILENT_TAG_PATTERN.finditer(text):
+    # 找出静默标记的同时得到移除它们之后的文本，无需再扫描一遍
+    silent_matches, cleaned_text = _remove_matches(SILENT_TAG_PATTERN, text)
+    for m in silent_matches:
         full_tag = m.group(0)
-        log.debug(f"AI_Parser: 发现静默标记: {full_tag}")
+        log.debug("AI_Parser: 发现静默标记: %s", full_tag)
         try:
             tag_type, content = full_tag[1:-1].split(":", 1)
             
             if tag_type == "note":
-                if ":" in content and content.endswith(":delete"):
-                    note_id_str = content.rsplit(":", 1)[0]
+                delete_match = NOTE_DELETE_PATTERN.fullmatch(content)
+                if delete_match:
+                    note_id_str = delete_match.group(1)
                     notebook.delete_note(int(note_id_str), role=role_for_processing)
                     log.info(f"AI_Parser: 已为角色 '{role_for_processing}' 删除笔记 ID {note_id_str}。")
                 else:
@@ -98,14 +138,14 @@ async def _handle_silent_tags(text: str, chat_id: str, chat_type: str, active_ro
             
             elif tag_type == "get_context":
                 # get_context 工具调用已在 llm.py 中处理，这里只需要移除标记
-                log.debug(f"AI_Parser: 发现 get_context 标记，已在LLM层处理: {content}")
+                log.debug("AI_Parser: 发现 get_context 标记，已在LLM层处理: %s", content)
 
         except Exception as e:
             log.error(f"Error processing silent tag '{full_tag}': {e}", exc_info=True)
 
-    cleaned_text = SILENT_TAG_PATTERN.sub("", text).strip()
+    cleaned_text = cleaned_text.strip()
     if len(cleaned_text) < len(text):
-        log.debug(f"AI_Parser: 移除静默标记后的文本: \"{cleaned_text}\"")
+        log.debug("AI_Parser: 移除静默标记后的文本: \"%s\"", cleaned_text)
     return cleaned_text
 
 
@@ -119,24 +159,31 @@ async def _parse_visible_tags(
     """
     解析文本中的所有可见标记，并返回最终的消息段列表。
     """
-    # 提前处理 [reply] 标记
-    reply_match = re.search(r"\[reply(?:\s*:\s*(\d+))?\]", text)
+    # 提前处理 [reply] 标记：一次扫描同时找到第一个 reply 标记并移除所有 reply 标记
+    reply_matches, text = _remove_matches(REPLY_TAG_PATTERN, text)
+    reply_match = reply_matches[0] if reply_matches else None
     should_reply = bool(reply_match)
     # 如果 [reply] 标签中指定了 ID，则使用它；否则，使用传入的 message_id
     reply_to_id = reply_match.group(1) if reply_match and reply_match.group(1) else message_id
-    text = re.sub(r"\[reply(?:\s*:\s*\d+)?\]", "", text) # 移除 reply 标签
 
-    segments_placeholders: List[Optional[MessageSegment]] = []
+    matches = list(VISIBLE_TAG_PATTERN.finditer(text))
+    # 每个标记最多产生一个前置文本段和一个标记段，末尾再加一个文本段；
+    # 预先分配好列表，按游标 k 写入，未用到的位置保持 None，在最后的过滤中丢弃
+    segments_placeholders: List[Optional[MessageSegment]] = [None] * (2 * len(matches) + 1)
+    k = 0
     music_tasks = []
     music_indices: Dict[int, int] = {}
     last_idx = 0
 
-    session_manager = session if session else aiohttp.ClientSession()
+    # 只有存在 [music:] 标记时才需要网络请求；绝大多数消息没有，此时不创建会话（连接器、DNS 解析器、SSL 上下文等）
+    owns_session = not session and any(m.group(1) == "music" for m in matches)
+    session_manager = aiohttp.ClientSession() if owns_session else session
     
     try:
-        for i, m in enumerate(VISIBLE_TAG_PATTERN.finditer(text)):
+        for m in matches:
             if m.start() > last_idx:
-                segments_placeholders.append({"type": "text", "data": {"text": text[last_idx:m.start()]}})
+                segments_placeholders[k] = {"type": "text", "data": {"text": text[last_idx:m.start()]}}
+                k += 1
 
             tag_full = m.group(0)
             # 使用更安全的分割方式
@@ -148,25 +195,28 @@ async def _parse_visible_tags(
                 continue
 
             if tag_type in ("@qq", "CQ:at,qq="):
-                qq = re.search(r'\d+', content).group(0)
-                segments_placeholders.append({"type": "at", "data": {"qq": qq}})
+                qq = DIGITS_PATTERN.search(content).group(0)
+                segments_placeholders[k] = {"type": "at", "data": {"qq": qq}}
+                k += 1
             
             elif tag_type == "poke":
-                qq = re.search(r'\d+', content).group(0)
-                segments_placeholders.append({"type": "poke", "data": {"qq": qq}})
+                qq = DIGITS_PATTERN.search(content).group(0)
+                segments_placeholders[k] = {"type": "poke", "data": {"qq": qq}}
+                k += 1
                 
             elif tag_type == "emoji":
                 emoji_id = _clean_tag_content(content)
                 emoji = emoji_storage.find_emoji_by_id(emoji_id)
                 if emoji:
-                    segments_placeholders.append({"type": "image", "data": {"file": emoji["file"], "url": emoji["url"]}})
+                    segments_placeholders[k] = {"type": "image", "data": {"file": emoji["file"], "url": emoji["url"]}}
                 else:
-                    segments_placeholders.append({"type": "text", "data": {"text": f"[emoji not found: {emoji_id}]"}})
+                    segments_placeholders[k] = {"type": "text", "data": {"text": f"[emoji not found: {emoji_id}]"}}
+                k += 1
 
             elif tag_type == "music":
                 query = _clean_tag_content(content)
-                placeholder_idx = len(segments_placeholders)
-                segments_placeholders.append(None) # 占位
+                placeholder_idx = k
+                k += 1 # 占位，结果在下面回填
                 task_idx = len(music_tasks)
                 music_tasks.append(fetch_music_data(session_manager, query))
                 music_indices[task_idx] = placeholder_idx
@@ -174,13 +224,15 @@ async def _parse_visible_tags(
             elif tag_type == "longtext":
                 # 直接提取内容，保留换行符
                 long_text_content = content 
-                segments_placeholders.append({"type": "text", "data": {"text": long_text_content}})
+                segments_placeholders[k] = {"type": "text", "data": {"text": long_text_content}}
+                k += 1
 
 
             last_idx = m.end()
 
         if last_idx < len(text):
-            segments_placeholders.append({"type": "text", "data": {"text": text[last_idx:]}})
+            segments_placeholders[k] = {"type": "text", "data": {"text": text[last_idx:]}}
+            k += 1
 
         if music_tasks:
             music_results = await asyncio.gather(*music_tasks, return_exceptions=True)
@@ -192,7 +244,7 @@ async def _parse_visible_tags(
                 else:
                     segments_placeholders[placeholder_idx] = result
     finally:
-        if not session:
+        if owns_session:
             await session_manager.close()
 
     final_segments = [seg for seg in segments_placeholders if seg and seg.get("data", {}).get("text", True)]
@@ -1,40 +1,75 @@
 import os
-import json
 
 from config import config
+from common.json_utils import load_json_file, dump_json_file
 
 WHITELIST_FILE = os.path.join("config", "whitelist.json")
 
+# 白名单的内存缓存：只有当文件的 mtime 发生变化时才重新解析 JSON
+_cache = {"mtime": None, "data": None}
+
+# 调试开关在导入时读取一次，配置重新加载后调用 refresh_debug_flag() 刷新
+_DEBUG = bool(config.get("debug"))
+
+
+def refresh_debug_flag():
+    """重新从配置中读取 debug 开关。"""
+    global _DEBUG
+    _DEBUG = bool(config.get("debug"))
+
+
+def _get_mtime():
+    """返回白名单文件的 mtime，文件不存在时返回 None。"""
+    try:
+        return os.stat(WHITELIST_FILE).st_mtime
+    except OSError:
+        return None
+
+
 def load_whitelist():
     """
     加载白名单数据。如果文件不存在则返回默认结构，
-    默认结构为 {"msg": [], "group": []}。
+    默认结构为 {"msg": set(), "group": set()}。
+    文件未修改时直接返回内存中缓存的数据。
     """
-    if not os.path.exists(WHITELIST_FILE):
-        return {"msg": [], "group": []}
+    mtime = _get_mtime()
+    if mtime is None:
+        _cache["mtime"] = None
+        _cache["data"] = None
+        return {"msg": set(), "group": set()}
+    if _cache["data"] is not None and _cache["mtime"] == mtime:
+        return _cache["data"]
     try:
-        with open(WHITELIST_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            if not isinstance(data, dict):
-                data = {"msg": [], "group": []}
-            if "msg" not in data:
-                data["msg"] = []
-            if "group" not in data:
-                data["group"] = []
-            return data
+        data = load_json_file(WHITELIST_FILE)
+        if not isinstance(data, dict):
+            data = {}
+        # 内存中以 set 存储，成员判断为 O(1)
+        data = {
+            "msg": set(map(str, data.get("msg", []))),
+            "group": set(map(str, data.get("group", []))),
+        }
+        _cache["mtime"] = mtime
+        _cache["data"] = data
+        return data
     except Exception as e:
         print("加载白名单出错:", e)
-        return {"msg": [], "group": []}
+        return {"msg": set(), "group": set()}
 
 
 def save_whitelist(whitelist):
     """
-    保存白名单数据至文件
+    保存白名单数据至文件，并同步更新内存缓存。
+    集合按排序后的列表写入，保证文件内容稳定。
     """
     try:
-        with open(WHITELIST_FILE, "w", encoding="utf-8") as f:
-            json.dump(whitelist, f, ensure_ascii=False, indent=2)
+        data_to_save = {"msg": sorted(whitelist["msg"]), "group": sorted(whitelist["group"])}
+        dump_json_file(WHITELIST_FILE, data_to_save)
+        _cache["mtime"] = _get_mtime()
+        _cache["data"] = whitelist
     except Exception as e:
+        # 写入失败时丢弃缓存，下次从文件重新加载
+        _cache["mtime"] = None
+        _cache["data"] = None
         print("保存白名单出错:", e)
 
 
@@ -45,7 +80,7 @@ def add_whitelist(target, is_group=False):
     whitelist = load_whitelist()
     key = "group" if is_group else "msg"
     if target not in whitelist[key]:
-        whitelist[key].append(target)
+        whitelist[key].add(target)
         save_whitelist(whitelist)
         return True
     return False
@@ -58,7 +93,7 @@ def remove_whitelist(target, is_group=False):
     whitelist = load_whitelist()
     key = "group" if is_group else "msg"
     if target in whitelist[key]:
-        whitelist[key].remove(target)
+        whitelist[key].discard(target)
         save_whitelist(whitelist)
         return True
     return False
@@ -70,6 +105,6 @@ def is_whitelisted(target, is_group=False):
     """
     whitelist = load_whitelist()
     key = "group" if is_group else "msg"
-    if config.get("debug"):
-        print(f"检查白名单[{key}]，目标: {target}, 列表内容: {whitelist.get(key, [])}")
+    if _DEBUG:
+        print(f"检查白名单[{key}]，目标: {target}, 列表内容: {sorted(whitelist.get(key, ()))}")
     return target in whitelist[key]
@@ -1,14 +1,42 @@
-import json
 import os
-from typing import Dict, Any, Optional, List
+import atexit
+import threading
+from typing import Dict, Any, Optional, List, Tuple
 import time
+from itertools import chain, islice
+
+from common.json_utils import load_json_file, dump_json_file
+from logger import log
+
+# 表情包提示中固定不变的说明文字
+EMOJI_PROMPT_INSTRUCTIONS = (
+    "可以在对话中使用表情包来提升回复的趣味性，但一定要注意表情包的适当、合理使用。\n"
+    "每个表情包的格式为：表情包描述 (ID: 表情包ID)\n"
+)
+EMOJI_PROMPT_USAGE = "\n\n使用表情包时，请使用[emoji:表情包ID]的格式。例如：[emoji:0c6e51da3431db3b34be8df446592b4f]"
 
 class EmojiStorage:
     def __init__(self):
         self.storage_file = "data/emoji_storage.json"
         self.emoji_data = self._load_storage()
+        # 已使用的 summary 集合，用于 O(1) 判断重名
+        self._summaries = {e.get("summary") for e in self.emoji_data.get("emojis", {}).values()}
         self._rotation_index = 0  # 轮换起始索引
         self.MAX_EMOJI_PER_PROMPT = 20 # 每次提示中包含的最大表情数
+        # 每次表情数据发生变化时递增，用于使提示缓存失效
+        self.version = 0
+        # 已格式化的提示缓存 {(version, start_index): prompt}
+        self._prompt_cache: Dict[tuple, str] = {}
+        # 用于渲染提示的 (summary, emoji_id) 元组列表，与 emoji_data 的插入顺序一致
+        self._render_tuples: List[Tuple[str, str]] = [
+            self._render_tuple(e) for e in self.emoji_data.get("emojis", {}).values()
+        ]
+        # 延迟写盘：标记脏数据后由定时器合并写入
+        self.SAVE_DELAY_SECONDS = 2.0
+        self._dirty = False
+        self._flush_timer: Optional[threading.Timer] = None
+        self._save_lock = threading.Lock()
+        atexit.register(self._flush_if_dirty)
         
     def _load_storage(self) -> Dict[str, Any]:
         """加载表情包存储文件"""
@@ -17,8 +45,7 @@ class EmojiStorage:
             
         if os.path.exists(self.storage_file):
             try:
-                with open(self.storage_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                return load_json_file(self.storage_file)
             except Exception as e:
                 print(f"加载表情包存储文件失败: {e}")
                 return {"emojis": {}}
@@ -27,16 +54,33 @@ class EmojiStorage:
     def _save_storage(self):
         """保存表情包数据到文件"""
         try:
-            with open(self.storage_file, 'w', encoding='utf-8') as f:
-                json.dump(self.emoji_data, f, ensure_ascii=False, indent=2)
+            dump_json_file(self.storage_file, self.emoji_data, atomic=True)
         except Exception as e:
             print(f"保存表情包数据失败: {e}")
+
+    def _mark_dirty(self):
+        """标记数据已修改，并在没有待执行的定时器时安排一次延迟写盘"""
+        with self._save_lock:
+            self._dirty = True
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.SAVE_DELAY_SECONDS, self._flush_if_dirty)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def _flush_if_dirty(self):
+        """如果有未保存的修改则立即写盘（定时器回调及进程退出时调用）"""
+        with self._save_lock:
+            self._flush_timer = None
+            if not self._dirty:
+                return
+            self._dirty = False
+            self._save_storage()
     
     def _get_unique_summary(self, base_summary: str) -> str:
         """获取唯一的summary名称"""
         summary = base_summary
         counter = 1
-        while any(emoji["summary"] == summary for emoji in self.emoji_data["emojis"].values()):
+        while summary in self._summaries:
             summary = f"{base_summary}-{counter}"
             counter += 1
         return summary
@@ -58,7 +102,7 @@ class EmojiStorage:
                         
                     # 检查是否已存在相同的emoji_id
                     if data["emoji_id"] in self.emoji_data["emojis"]:
-                        print(f"[Debug] 跳过重复的表情包: {data['emoji_id']}")
+                        log.debug("跳过重复的表情包: %s", data['emoji_id'])
                         return True
                         
                     # 获取基础信息
@@ -79,8 +123,12 @@ class EmojiStorage:
                     
                     # 使用emoji_id作为唯一标识符存储
                     self.emoji_data["emojis"][data["emoji_id"]] = emoji_record
-                    self._save_storage()
-                    print(f"[Debug] 成功存储新表情包: {unique_summary} (ID: {data['emoji_id']})")
+                    self._summaries.add(unique_summary)
+                    self.version += 1
+                    self._prompt_cache.clear()
+                    self._render_tuples.append(self._render_tuple(emoji_record))
+                    self._mark_dirty()
+                    log.debug("成功存储新表情包: %s (ID: %s)", unique_summary, data['emoji_id'])
                     return True
                     
             return False
@@ -102,36 +150,54 @@ class EmojiStorage:
         if not all_emojis_dict:
             return ""
 
-        all_emojis_list = list(all_emojis_dict.values())
-        total_emojis = len(all_emojis_list)
-        current_emojis_to_show: List[Dict[str, Any]] = []
+        total_emojis = len(all_emojis_dict)
 
         if total_emojis <= self.MAX_EMOJI_PER_PROMPT:
             # 如果总数小于等于限制，显示全部
-            current_emojis_to_show = all_emojis_list
+            start_index = 0
             self._rotation_index = 0 # 重置索引
         else:
             start_index = self._rotation_index
-            end_index = start_index + self.MAX_EMOJI_PER_PROMPT
-            if end_index <= total_emojis:
-                current_emojis_to_show = all_emojis_list[start_index:end_index]
-            else: # 需要回绕
-                current_emojis_to_show = all_emojis_list[start_index:] + all_emojis_list[:end_index % total_emojis]
-
             # 更新下一次的起始索引
-            self._rotation_index = end_index % total_emojis
+            self._rotation_index = (start_index + self.MAX_EMOJI_PER_PROMPT) % total_emojis
+
+        cache_key = (self.version, start_index)
+        prompt = self._prompt_cache.get(cache_key)
+        if prompt is None:
+            prompt = self._build_emoji_prompt(self._render_tuples, start_index)
+            self._prompt_cache[cache_key] = prompt
+        return prompt
+
+    @staticmethod
+    def _render_tuple(emoji: Dict[str, Any]) -> Tuple[str, str]:
+        """提取渲染提示所需的字段"""
+        return emoji.get('summary', '[未知描述]'), emoji.get('emoji_id', 'N/A')
+
+    def _build_emoji_prompt(self, all_emojis_list: List[Tuple[str, str]], start_index: int) -> str:
+        """按轮换起始索引格式化表情包提示"""
+        total_emojis = len(all_emojis_list)
+        current_emojis_to_show: List[Tuple[str, str]] = []
+
+        if total_emojis <= self.MAX_EMOJI_PER_PROMPT:
+            current_emojis_to_show = all_emojis_list
+        else:
+            # 在首尾相接的视图上切片，回绕时无需拼接中间列表
+            current_emojis_to_show = list(islice(
+                chain(all_emojis_list, all_emojis_list),
+                start_index,
+                start_index + self.MAX_EMOJI_PER_PROMPT
+            ))
 
         # 格式化当前轮换的表情列表
         current_emoji_list_str = "\n".join([
-            f"- {e.get('summary', '[未知描述]')} (ID: {e.get('emoji_id', 'N/A')})"
-            for e in current_emojis_to_show
+            f"- {summary} (ID: {emoji_id})"
+            for summary, emoji_id in current_emojis_to_show
         ])
 
         prompt = f"\n\n当前可用表情包 (共 {len(current_emojis_to_show)} 个):\n"
-        prompt += "可以在对话中使用表情包来提升回复的趣味性，但一定要注意表情包的适当、合理使用。\n"
-        prompt += "每个表情包的格式为：表情包描述 (ID: 表情包ID)\n"
+        prompt += EMOJI_PROMPT_INSTRUCTIONS
         prompt += current_emoji_list_str
-        prompt += "\n\n使用表情包时，请使用[emoji:表情包ID]的格式。例如：[emoji:0c6e51da3431db3b34be8df446592b4f]"
+        prompt += EMOJI_PROMPT_USAGE
         return prompt
 
 # 创建全局实例
@@ -1,6 +1,9 @@
 import os
-import json
+import re
+from collections import OrderedDict
+from functools import lru_cache
 from config import config
+from common.json_utils import json_dumps, load_json_file, write_bytes_atomic
 from storage.notebook import notebook, DEFAULT_ROLE_KEY
 from storage.emoji_storage import emoji_storage
 import core.role_manager as role_manager
@@ -9,42 +12,154 @@ from logger import log
 PRIVATE_DIR = os.path.join("data", "conversation", "private")
 GROUP_DIR = os.path.join("data", "conversation", "group")
 DEFAULT_ROLE_FILENAME = "default.json"
-os.makedirs(PRIVATE_DIR, exist_ok=True)
-os.makedirs(GROUP_DIR, exist_ok=True)
+
+# 本进程中已确认存在的目录，避免每条消息都触发 mkdir/stat 系统调用
+_dirs_made: set = set()
+
+def _ensure_dir(path: str):
+    if path not in _dirs_made:
+        os.makedirs(path, exist_ok=True)
+        _dirs_made.add(path)
+
+_ensure_dir(PRIVATE_DIR)
+_ensure_dir(GROUP_DIR)
+
+# 每个历史文件最近一次写入内容的哈希，用于跳过内容未变化的写入
+_last_write_hash: dict = {}
+
+# 已解析历史文件的 LRU 缓存 {history_file: (mtime_ns, parsed_list)}
+_HISTORY_CACHE_SIZE = 128
+_history_cache: "OrderedDict[str, tuple]" = OrderedDict()
+
+def _remember_history(history_file: str, mtime_ns: int, parsed: list):
+    _history_cache[history_file] = (mtime_ns, parsed)
+    _history_cache.move_to_end(history_file)
+    if len(_history_cache) > _HISTORY_CACHE_SIZE:
+        _history_cache.popitem(last=False)
+
+def _read_history_file(history_file: str) -> list:
+    """读取并解析历史文件；文件 mtime 未变化时直接返回缓存的解析结果。"""
+    mtime_ns = os.stat(history_file).st_mtime_ns
+    cached = _history_cache.get(history_file)
+    if cached is not None and cached[0] == mtime_ns:
+        _history_cache.move_to_end(history_file)
+        return cached[1]
+    file_history = load_json_file(history_file)
+    _remember_history(history_file, mtime_ns, file_history)
+    return file_history
+
+# 默认角色对应的 role_marker 取值
+_DEFAULT_ROLE_MARKERS = frozenset((None, DEFAULT_ROLE_KEY))
+# 工具调用结果等需要跨角色保留的系统消息标记
+_INTERNAL_SYSTEM_TAG = "[系统内部]"
+
+def _is_specific_role(role_to_use) -> bool:
+    return bool(role_to_use) and role_to_use != DEFAULT_ROLE_KEY
+
+def _filter_loaded_history(file_history, role_to_use):
+    """
+    单次遍历筛选从文件加载的历史：保留工具调用系统消息，
+    以及属于当前角色（默认角色则为不带 role_marker 或标记为默认）的对话。
+    """
+    is_specific = _is_specific_role(role_to_use)
+    default_markers = _DEFAULT_ROLE_MARKERS
+    internal_tag = _INTERNAL_SYSTEM_TAG
+    filtered = []
+    append = filtered.append
+    for msg in file_history:
+        get = msg.get
+        if get("role") == "system":
+            if internal_tag in (get("content") or ""):
+                append(msg)
+            continue
+        marker = get("role_marker")
+        if (marker == role_to_use) if is_specific else (marker in default_markers):
+            append(msg)
+    return filtered
+
+def _filter_history_to_save(history, role_to_use):
+    """筛选需要写入当前角色历史文件的消息。"""
+    if _is_specific_role(role_to_use):
+        # 只保留当前角色的对话和系统消息
+        return [msg for msg in history if msg.get("role") == "system" or msg.get("role_marker") == role_to_use]
+    # 对于默认角色，保存所有不带特定role_marker或标记为default的历史
+    default_markers = _DEFAULT_ROLE_MARKERS
+    return [msg for msg in history if msg.get("role_marker") in default_markers]
+
+# 通用 system_prompt.txt 的内容缓存，仅在文件 mtime 变化时重新读取
+SYSTEM_PROMPT_FILE = os.path.join("config", "system_prompt.txt")
+_system_prompt_cache = {"mtime": None, "text": ""}
+
+def _load_system_prompt() -> str:
+    """返回通用 system_prompt.txt 的内容，文件被修改后自动重新加载。"""
+    try:
+        mtime = os.stat(SYSTEM_PROMPT_FILE).st_mtime
+        if mtime != _system_prompt_cache["mtime"]:
+            with open(SYSTEM_PROMPT_FILE, "r", encoding="utf-8") as sp:
+                _system_prompt_cache["text"] = sp.read().strip()
+            _system_prompt_cache["mtime"] = mtime
+    except Exception as e_sp:
+        log.error(f"读取通用 system_prompt.txt 失败: {e_sp}")
+        _system_prompt_cache["mtime"] = None
+        _system_prompt_cache["text"] = ""
+    return _system_prompt_cache["text"]
+
+_load_system_prompt()
+
+# 系统提示基础部分（角色提示词/通用提示词 + 笔记）的缓存
+# key: (role_to_use, role_specific_prompt, system_prompt_text, notebook.version)
+_SYSTEM_CONTENT_CACHE_SIZE = 64
+_system_content_cache: "OrderedDict[tuple, str]" = OrderedDict()
+
+def _build_base_system_content(role_to_use, role_specific_prompt, system_prompt_text) -> str:
+    """构建系统提示中不随表情轮换变化的部分：角色/通用提示词与角色笔记。"""
+    base_system_prompt = ""
+    if role_specific_prompt:
+        log.debug("History: 找到了角色 '%s' 的专属提示词。", role_to_use)
+        base_system_prompt = role_specific_prompt.strip()
+    elif role_to_use:
+        log.debug("History: 角色 '%s' 没有专属提示词。", role_to_use)
+
+    if not base_system_prompt and system_prompt_text:
+        base_system_prompt = system_prompt_text
+        log.debug("History: 使用了通用的 system_prompt.txt。")
+
+    role_key_for_notes = role_to_use if role_to_use else DEFAULT_ROLE_KEY
+    log.debug("History: 用于获取笔记的角色key是: '%s'", role_key_for_notes)
+    notes_context = notebook.get_notes_as_context(role=role_key_for_notes)
+    if notes_context:
+        base_system_prompt = f"{base_system_prompt}\n\n{notes_context}"
+        log.debug("History: 添加了角色笔记到 system_prompt。")
+    return base_system_prompt
 
 def get_latest_system_content(chat_id: str, chat_type: str, active_role_name: str = None) -> str:
     """获取最新的系统提示。"""
-    log.debug(f"History: 开始获取 system_content, chat_id={chat_id}, active_role_name='{active_role_name}'")
-    base_system_prompt = ""
+    log.debug("History: 开始获取 system_content, chat_id=%s, active_role_name='%s'", chat_id, active_role_name)
     try:
         role_to_use = active_role_name if active_role_name is not None else role_manager.get_active_role(chat_id, chat_type)
-        log.debug(f"History: 用于获取提示词的角色是 '{role_to_use}'")
+        log.debug("History: 用于获取提示词的角色是 '%s'", role_to_use)
 
         role_specific_prompt = None
         if role_to_use:
             # 直接将 role_to_use (即我们关心的角色) 传递给 get_active_role_prompt
             role_specific_prompt = role_manager.get_active_role_prompt(chat_id, chat_type, role_name_override=role_to_use)
-            if role_specific_prompt:
-                log.debug(f"History: 找到了角色 '{role_to_use}' 的专属提示词。")
-                base_system_prompt = role_specific_prompt.strip()
-            else:
-                log.debug(f"History: 角色 '{role_to_use}' 没有专属提示词。")
-
-        if not base_system_prompt:
-            try:
-                with open(os.path.join("config", "system_prompt.txt"), "r", encoding="utf-8") as sp:
-                    base_system_prompt = sp.read().strip()
-                log.debug("History: 使用了通用的 system_prompt.txt。")
-            except Exception as e_sp:
-                log.error(f"读取通用 system_prompt.txt 失败: {e_sp}")
-
-        role_key_for_notes = role_to_use if role_to_use else DEFAULT_ROLE_KEY
-        log.debug(f"History: 用于获取笔记的角色key是: '{role_key_for_notes}'")
-        notes_context = notebook.get_notes_as_context(role=role_key_for_notes)
-        if notes_context:
-            base_system_prompt = f"{base_system_prompt}\n\n{notes_context}"
-            log.debug("History: 添加了角色笔记到 system_prompt。")
-            
+
+        # 角色没有专属提示词时才需要通用提示词
+        system_prompt_text = None if role_specific_prompt and role_specific_prompt.strip() else _load_system_prompt()
+
+        # 只有提示词、通用提示文件或笔记发生变化时才重新构建
+        cache_key = (role_to_use, role_specific_prompt, system_prompt_text, notebook.version)
+        base_system_prompt = _system_content_cache.get(cache_key)
+        if base_system_prompt is None:
+            base_system_prompt = _build_base_system_content(role_to_use, role_specific_prompt, system_prompt_text)
+            _system_content_cache[cache_key] = base_system_prompt
+            if len(_system_content_cache) > _SYSTEM_CONTENT_CACHE_SIZE:
+                _system_content_cache.popitem(last=False)
+        else:
+            _system_content_cache.move_to_end(cache_key)
+            log.debug("History: 命中 system_content 缓存。")
+
+        # 表情包提示带有轮换逻辑，每次调用都需要重新获取
         emoji_prompt = emoji_storage.get_emoji_system_prompt()
         if emoji_prompt:
             base_system_prompt = f"{base_system_prompt}{emoji_prompt}"
@@ -56,22 +171,29 @@ def get_latest_system_content(chat_id: str, chat_type: str, active_role_name: st
         log.error(f"生成最终 system_content 失败 (chat_id={chat_id}, chat_type={chat_type}): {e}")
         return ""
 
+# 角色名中只保留字母数字（含中文等 Unicode 字符）、'-' 和 '_'，与 str.isalnum 的判断一致
+_UNSAFE_ROLE_CHARS = re.compile(r"[^\w-]+")
+
+@lru_cache(maxsize=512)
+def _safe_role_name(role_name: str) -> str:
+    return _UNSAFE_ROLE_CHARS.sub("", role_name)
+
+@lru_cache(maxsize=1024)
+def _history_file_path(id_str: str, chat_type: str, role_to_use) -> str:
+    """计算历史文件路径（纯函数，结果可缓存）。"""
+    base_dir = GROUP_DIR if chat_type == "group" else PRIVATE_DIR
+    chat_dir = os.path.join(base_dir, id_str)
+    if role_to_use and role_to_use != DEFAULT_ROLE_KEY:
+        return os.path.join(chat_dir, f"{_safe_role_name(role_to_use)}.json")
+    return os.path.join(chat_dir, DEFAULT_ROLE_FILENAME)
+
 def get_history_file(id_str: str, chat_type: str = "private", active_role_name: str = None) -> str:
     """根据提供的角色名（或当前激活的角色）获取历史文件路径。"""
-    base_dir = GROUP_DIR if chat_type == "group" else PRIVATE_DIR
-    
     role_to_use = active_role_name if active_role_name is not None else role_manager.get_active_role(id_str, chat_type)
+    history_file = _history_file_path(id_str, chat_type, role_to_use)
 
-    if role_to_use and role_to_use != DEFAULT_ROLE_KEY:
-        chat_dir = os.path.join(base_dir, id_str)
-        safe_role_name = "".join(c for c in role_to_use if c.isalnum() or c in ('-', '_'))
-        history_file = os.path.join(chat_dir, f"{safe_role_name}.json")
-    else:
-        chat_dir = os.path.join(base_dir, id_str)
-        history_file = os.path.join(chat_dir, DEFAULT_ROLE_FILENAME)
-
-    os.makedirs(os.path.dirname(history_file), exist_ok=True)
-    log.debug(f"History: 确定历史文件路径为: '{history_file}' (角色: '{role_to_use}')")
+    _ensure_dir(os.path.dirname(history_file))
+    log.debug("History: 确定历史文件路径为: '%s' (角色: '%s')", history_file, role_to_use)
     return history_file
 
 def load_conversation_history(id_str: str, chat_type: str = "private", active_role_name: str = None):
@@ -83,28 +205,18 @@ def load_conversation_history(id_str: str, chat_type: str = "private", active_ro
     try:
         history = [system_msg]
         if os.path.exists(history_file):
-            log.debug(f"History: 找到了存在的历史文件: '{history_file}', 正在加载...")
-            with open(history_file, "r", encoding="utf-8") as f:
-                file_history = json.load(f)
+            log.debug("History: 找到了存在的历史文件: '%s', 正在加载...", history_file)
+            file_history = _read_history_file(history_file)
             
             # 根据角色筛选加载的历史记录
             role_to_use = active_role_name if active_role_name is not None else role_manager.get_active_role(id_str, chat_type)
-            if role_to_use and role_to_use != DEFAULT_ROLE_KEY:
-                # 只加载当前角色的对话，但保留重要的系统消息（如工具调用结果）
-                filtered_history = [msg for msg in file_history if 
-                                   (msg.get("role") == "system" and "[系统内部]" in msg.get("content", "")) or  # 保留工具调用系统消息
-                                   (msg.get("role") != "system" and msg.get("role_marker") == role_to_use)]
-            else:
-                # 对于默认角色，加载不带特定role_marker或标记为default的历史，但保留重要的系统消息
-                filtered_history = [msg for msg in file_history if 
-                                   (msg.get("role") == "system" and "[系统内部]" in msg.get("content", "")) or  # 保留工具调用系统消息
-                                   (msg.get("role") != "system" and msg.get("role_marker") in [None, DEFAULT_ROLE_KEY])]
+            filtered_history = _filter_loaded_history(file_history, role_to_use)
 
             if filtered_history:
                 history.extend(filtered_history)
-                log.debug(f"History: 从文件加载了 {len(filtered_history)} 条消息（已筛选），合并后共 {len(history)} 条。")
+                log.debug("History: 从文件加载了 %s 条消息（已筛选），合并后共 %s 条。", len(filtered_history), len(history))
         else:
-            log.debug(f"History: 未找到历史文件 '{history_file}', 将创建新的历史。")
+            log.debug("History: 未找到历史文件 '%s', 将创建新的历史。", history_file)
 
         return history
             
@@ -114,19 +226,13 @@ def load_conversation_history(id_str: str, chat_type: str = "private", active_ro
 
 def save_conversation_history(id_str, history, chat_type="private", active_role_name: str = None):
     history_file = get_history_file(id_str, chat_type, active_role_name=active_role_name)
-    log.debug(f"History: 准备保存 {len(history)} 条历史到 '{history_file}'")
+    log.debug("History: 准备保存 %s 条历史到 '%s'", len(history), history_file)
     try:
         latest_system_content = get_latest_system_content(id_str, chat_type, active_role_name=active_role_name)
         
         # 根据角色筛选要保存的历史记录
         role_to_use = active_role_name if active_role_name is not None else role_manager.get_active_role(id_str, chat_type)
-        if role_to_use and role_to_use != DEFAULT_ROLE_KEY:
-            # 只保留当前角色的对话和系统消息
-            history_to_save = [msg for msg in history if msg.get("role") == "system" or msg.get("role_marker") == role_to_use]
-        else:
-            # 对于默认角色，保存所有不带特定role_marker或标记为default的历史
-            history_to_save = [msg for msg in history if msg.get("role_marker") in [None, DEFAULT_ROLE_KEY]]
-
+        history_to_save = _filter_history_to_save(history, role_to_use)
 
         found_system_prompt = False
         for message in history_to_save:
@@ -137,8 +243,15 @@ def save_conversation_history(id_str, history, chat_type="private", active_role_
         if not found_system_prompt:
             history_to_save.insert(0, {"role": "system", "content": latest_system_content})
             
-        with open(history_file, "w", encoding="utf-8") as f:
-            json.dump(history_to_save, f, ensure_ascii=False, indent=2)
-        log.debug(f"History: 成功保存 {len(history_to_save)} 条历史到 '{history_file}'")
+        payload = json_dumps(history_to_save, indent=True)
+        payload_hash = hash(payload)
+        if _last_write_hash.get(history_file) == payload_hash and os.path.exists(history_file):
+            log.debug("History: 历史内容未变化，跳过写入 '%s'", history_file)
+            return
+        write_bytes_atomic(history_file, payload)
+        _last_write_hash[history_file] = payload_hash
+        # 刚写入的内容就是下次加载会解析出的内容，直接放入缓存
+        _remember_history(history_file, os.stat(history_file).st_mtime_ns, history_to_save)
+        log.debug("History: 成功保存 %s 条历史到 '%s'", len(history_to_save), history_file)
     except Exception as e:
         log.error(f"保存对话历史记录失败 (文件: {history_file}): {e}")
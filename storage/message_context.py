@@ -1,9 +1,15 @@
 import os
 import json
 import time
-from collections import deque
+import atexit
+import asyncio
+import threading
+from collections import deque, defaultdict
+from itertools import islice
 from typing import List, Dict, Any, Optional
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass
+from common.json_utils import json_dumps, json_loads, load_json_file, write_bytes_atomic
+from common.time_utils import format_timestamp
 from logger import log
 
 @dataclass
@@ -22,25 +28,43 @@ class ContextMessage:
 class MessageContextManager:
     """消息上下文管理器，负责存储和检索群聊消息历史"""
     
-    def __init__(self, max_memory_size: int = 1000, max_file_messages: int = 10000):
+    def __init__(self, max_memory_size: int = 1000, max_file_messages: int = 10000, compact_interval: int = 500):
         """
         初始化消息上下文管理器
         
         Args:
             max_memory_size: 内存中保存的消息数量
             max_file_messages: 文件中保存的最大消息数量
+            compact_interval: 每追加多少条消息压缩一次文件
         """
         self.max_memory_size = max_memory_size
         self.max_file_messages = max_file_messages
+        self.compact_interval = compact_interval
         
         # 内存中的消息缓存 {chat_id: deque[ContextMessage]}
         self.memory_cache: Dict[str, deque] = {}
+        # 自上次压缩以来追加到文件的消息数 {chat_id: int}
+        self._appends_since_compact: Dict[str, int] = {}
+        # 已检查过旧版 JSON 文件的聊天
+        self._migrated_chats: set = set()
+        # 每个聊天文件中已写入的用户名表与聊天信息 {chat_id: {user_id: username}} / {chat_id: (chat_id, chat_type)}
+        self._user_tables: Dict[str, Dict[str, str]] = {}
+        self._chat_meta: Dict[str, tuple] = {}
+        # 后台写入队列与写入任务，在事件循环中首次写入时创建
+        self._write_queue: Optional[asyncio.Queue] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        # 所有写文件的路径（同步追加、线程池中的批量写入、压缩、旧文件迁移、退出时的补写）共用，
+        # 避免同时追加或替换同一个文件；可重入，批量写入中会再进入迁移
+        self._write_lock = threading.RLock()
         
         # 数据目录
         self.context_dir = os.path.join("data", "message_context")
         os.makedirs(self.context_dir, exist_ok=True)
         
         log.info(f"MessageContextManager 初始化完成，内存缓存: {max_memory_size}, 文件存储: {max_file_messages}")
+
+        # 事件循环结束后后台写入任务不会再运行，进程退出时把队列中剩余的消息写入文件
+        atexit.register(self._drain_write_queue)
     
     def add_message(self, 
                    chat_id: str,
@@ -75,8 +99,78 @@ class MessageContextManager:
         self.memory_cache[chat_id].append(message)
         log.debug(f"消息已添加到上下文缓存: {chat_id} - {username}: {content[:50]}...")
         
-        # 异步写入文件（这里同步写入，实际项目中可能需要异步）
-        self._append_to_file(chat_id, message)
+        # 在事件循环中运行时交给后台任务批量写入，避免阻塞循环；否则直接同步写入
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._append_to_file(chat_id, message)
+            return
+        self._enqueue_write(chat_id, message, loop)
+
+    def _enqueue_write(self, chat_id: str, message: ContextMessage, loop: asyncio.AbstractEventLoop) -> None:
+        """将消息放入写入队列，必要时启动后台写入任务"""
+        if self._writer_task is None or self._writer_task.done():
+            # 上一个写入任务已结束（例如其事件循环已退出），先同步写入它队列中剩余的消息
+            self._drain_write_queue()
+            self._write_queue = asyncio.Queue()
+            self._writer_task = asyncio.create_task(self._writer_loop())
+        elif self._writer_task.get_loop() is not loop:
+            # 在其他线程的事件循环中（如经 asyncio.run 执行工具）：写入队列属于另一个事件循环，
+            # 跨线程 put_nowait 不安全，写入任务也可能不会被唤醒，改为加锁同步写入
+            self._append_to_file(chat_id, message)
+            return
+        self._write_queue.put_nowait((chat_id, message))
+
+    async def _writer_loop(self) -> None:
+        """取出当前队列中所有待写消息，按聊天分组后在线程池中批量追加"""
+        queue = self._write_queue
+        loop = asyncio.get_running_loop()
+        while True:
+            chat_id, message = await queue.get()
+            batches: Dict[str, List[ContextMessage]] = defaultdict(list)
+            batches[chat_id].append(message)
+            count = 1
+            while not queue.empty():
+                chat_id, message = queue.get_nowait()
+                batches[chat_id].append(message)
+                count += 1
+            try:
+                # 写入任务被取消（如退出时）也不撤销这批已从队列取出的消息的写入
+                await asyncio.shield(loop.run_in_executor(None, self._write_batches, batches))
+            except Exception as e:
+                log.error(f"批量写入上下文文件失败: {e}")
+            finally:
+                for _ in range(count):
+                    queue.task_done()
+
+    async def flush(self) -> None:
+        """等待写入队列中的消息全部落盘"""
+        if self._write_queue is not None and self._writer_task is not None and not self._writer_task.done():
+            await self._write_queue.join()
+
+    def _write_batches(self, batches: Dict[str, List[ContextMessage]]) -> None:
+        with self._write_lock:
+            for chat_id, messages in batches.items():
+                self._append_messages(chat_id, messages)
+
+    def _drain_write_queue(self) -> None:
+        """同步写入队列中尚未落盘的消息（进程退出时调用）"""
+        queue = self._write_queue
+        if queue is None:
+            return
+        batches: Dict[str, List[ContextMessage]] = defaultdict(list)
+        while True:
+            try:
+                chat_id, message = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            batches[chat_id].append(message)
+        if not batches:
+            return
+        try:
+            self._write_batches(batches)
+        except Exception as e:
+            log.error(f"退出时写入上下文文件失败: {e}")
     
     def get_recent_messages(self, 
                           chat_id: str, 
@@ -95,81 +189,220 @@ class MessageContextManager:
         Returns:
             按时间顺序排列的消息列表（最新的在最后）
         """
-        messages = []
-        
-        # 首先从内存缓存获取
-        if chat_id in self.memory_cache:
-            cache_messages = list(self.memory_cache[chat_id])
-            messages.extend(cache_messages)
-            log.debug(f"从内存缓存获取 {len(cache_messages)} 条消息")
+        skip_self = exclude_self and self_id
+        cache = self.memory_cache.get(chat_id, ())
         
-        # 如果内存中的消息不够，从文件读取
-        if len(messages) < count:
-            file_messages = self._load_from_file(chat_id, count - len(messages))
-            # 去重并按时间排序
-            all_messages = {msg.message_id: msg for msg in file_messages + messages}
-            messages = sorted(all_messages.values(), key=lambda x: x.timestamp)
-            log.debug(f"从文件加载消息，总计 {len(messages)} 条")
+        # 首先从内存缓存末尾取最多 count 条消息（排除机器人自己的消息），不复制整个缓存
+        recent_messages = list(islice(
+            (msg for msg in reversed(cache) if not (skip_self and msg.user_id == self_id)),
+            count
+        ))
+        recent_messages.reverse()
+        log.debug(f"从内存缓存获取 {len(recent_messages)} 条消息")
         
-        # 排除机器人自己的消息
-        if exclude_self and self_id:
-            messages = [msg for msg in messages if msg.user_id != self_id]
-            log.debug(f"排除机器人消息后剩余 {len(messages)} 条")
-        
-        # 取最后的 count 条消息
-        recent_messages = messages[-count:] if len(messages) > count else messages
+        # 如果内存中的消息不够（此时内存缓存已全部取完），从文件读取
+        if len(recent_messages) < count:
+            # 文件末尾同样包含内存中的消息，多读取这部分后再去重
+            file_messages = self._load_from_file(chat_id, count + len(cache))
+            # 内存缓存和文件都按时间排列，文件中不在内存里的消息更早，
+            # 从后往前取够需要的数量后拼在内存消息之前即可
+            seen = {msg.message_id for msg in cache}
+            needed = count - len(recent_messages)
+            older = []
+            for msg in reversed(file_messages):
+                if msg.message_id in seen or (skip_self and msg.user_id == self_id):
+                    continue
+                older.append(msg)
+                if len(older) >= needed:
+                    break
+            older.reverse()
+            recent_messages = older + recent_messages
+            log.debug(f"从文件加载消息，总计 {len(recent_messages)} 条")
         
         log.info(f"获取到 {len(recent_messages)} 条最近消息用于上下文")
         return recent_messages
     
+    def _get_safe_chat_id(self, chat_id: str) -> str:
+        return "".join(c for c in chat_id if c.isalnum() or c in ('-', '_'))
+
     def _get_file_path(self, chat_id: str) -> str:
-        """获取聊天的上下文文件路径"""
-        safe_chat_id = "".join(c for c in chat_id if c.isalnum() or c in ('-', '_'))
-        return os.path.join(self.context_dir, f"{safe_chat_id}_context.json")
+        """获取聊天的上下文文件路径（JSON Lines 格式，每行一条消息）"""
+        return os.path.join(self.context_dir, f"{self._get_safe_chat_id(chat_id)}_context.jsonl")
+
+    def _migrate_legacy_file(self, chat_id: str) -> None:
+        """将旧版整文件 JSON 数组格式的上下文转换为 JSON Lines 格式"""
+        if chat_id in self._migrated_chats:
+            return
+        # 整个迁移持有写锁，且重写成功后才标记为已迁移：
+        # 否则其他线程可能认为已迁移并开始追加，随后被迁移的重写覆盖
+        with self._write_lock:
+            if chat_id in self._migrated_chats:
+                return
+            legacy_path = os.path.join(self.context_dir, f"{self._get_safe_chat_id(chat_id)}_context.json")
+            file_path = self._get_file_path(chat_id)
+            if not os.path.exists(legacy_path) or os.path.exists(file_path):
+                self._migrated_chats.add(chat_id)
+                return
+            try:
+                data = load_json_file(legacy_path)
+                messages = [ContextMessage(**msg_data) for msg_data in data[-self.max_file_messages:]]
+                self._rewrite_file(chat_id, messages)
+                self._migrated_chats.add(chat_id)
+                os.remove(legacy_path)
+                log.info(f"已将上下文文件迁移为 JSON Lines 格式: {file_path}")
+            except Exception as e:
+                log.error(f"迁移旧版上下文文件失败 {legacy_path}: {e}")
+
+    # 文件中每行是以下几种记录之一：
+    #   {"m": {"chat_id": ..., "chat_type": ...}}  聊天信息，在消息之前写入
+    #   {"n": {user_id: username, ...}}             用户名表，首次出现的用户才写入
+    #   {"u": user_id, "i": message_id, "c": content, "t": timestamp, "s": segments}
+    #       消息记录；raw_content 与 content 不同时写入 "r"，
+    #       用户名与用户名表不同时写入 "n"
+    # 旧版的完整字段记录（以 "chat_id" 开头）仍可读取。
+
+    def _encode_messages(self, chat_id: str, messages: List[ContextMessage]) -> bytes:
+        """将消息编码为若干行，并按需写入聊天信息和新用户的用户名"""
+        names = self._user_tables.setdefault(chat_id, {})
+        lines = []
+        for message in messages:
+            meta = (message.chat_id, message.chat_type)
+            if self._chat_meta.get(chat_id) != meta:
+                self._chat_meta[chat_id] = meta
+                lines.append(json_dumps({"m": {"chat_id": meta[0], "chat_type": meta[1]}}))
+
+            record = {"u": message.user_id, "i": message.message_id, "c": message.content,
+                      "t": message.timestamp, "s": message.message_segments}
+            if message.raw_content != message.content:
+                record["r"] = message.raw_content
+            known_name = names.get(message.user_id)
+            if known_name is None:
+                names[message.user_id] = message.username
+                lines.append(json_dumps({"n": {message.user_id: message.username}}))
+            elif known_name != message.username:
+                record["n"] = message.username
+            lines.append(json_dumps(record))
+        return b"".join(line + b"\n" for line in lines)
+
+    def _read_file(self, chat_id: str, count: Optional[int] = None) -> List[ContextMessage]:
+        """
+        读取上下文文件，返回最后 count 条消息（count 为空时返回全部），
+        同时重建该聊天的用户名表和聊天信息
+        """
+        file_path = self._get_file_path(chat_id)
+        names: Dict[str, str] = {}
+        meta = (chat_id, 'group')
+        meta_known = False
+        message_lines = deque(maxlen=count) if count else []
+        total = 0
+
+        with open(file_path, 'rb') as f:
+            for line in f:
+                if line.startswith(b'{"n"'):
+                    names.update(json_loads(line)["n"])
+                elif line.startswith(b'{"m"'):
+                    info = json_loads(line)["m"]
+                    meta = (info["chat_id"], info["chat_type"])
+                    meta_known = True
+                elif line.strip():
+                    # 记录解析消息行时的聊天信息，消息行本身只在需要时才解析
+                    message_lines.append((line, meta))
+                    total += 1
+
+        # 内存中的表一旦建立即以其为准，这里只在首次读取时恢复
+        if chat_id not in self._user_tables:
+            self._user_tables[chat_id] = dict(names)
+            # 压缩计数只保存在内存中，每次启动都从 0 开始；文件中的消息已超过上限时，
+            # 让下一次追加立即压缩，否则两次重启之间消息不足 compact_interval 条的聊天永远不会被压缩
+            if total > self.max_file_messages:
+                self._appends_since_compact[chat_id] = self.compact_interval
+        if meta_known and chat_id not in self._chat_meta:
+            self._chat_meta[chat_id] = meta
+
+        messages = []
+        for line, (msg_chat_id, msg_chat_type) in message_lines:
+            try:
+                data = json_loads(line)
+                if "chat_id" in data:
+                    messages.append(ContextMessage(**data))
+                    continue
+                user_id = data["u"]
+                content = data["c"]
+                messages.append(ContextMessage(
+                    chat_id=msg_chat_id,
+                    chat_type=msg_chat_type,
+                    user_id=user_id,
+                    username=data.get("n", names.get(user_id, "")),
+                    message_id=data["i"],
+                    content=content,
+                    raw_content=data.get("r", content),
+                    timestamp=data["t"],
+                    message_segments=data["s"],
+                ))
+            except (json.JSONDecodeError, KeyError, TypeError) as e:
+                # 进程中断可能留下不完整的最后一行，跳过即可
+                log.warning(f"跳过无法解析的上下文记录 {file_path}: {e}")
+        return messages
+
+    def _rewrite_file(self, chat_id: str, messages: List[ContextMessage]) -> None:
+        """用给定消息重写整个文件：先写临时文件再原子替换，用户名表只保留仍被引用的用户"""
+        file_path = self._get_file_path(chat_id)
+        self._user_tables[chat_id] = {}
+        self._chat_meta.pop(chat_id, None)
+        data = self._encode_messages(chat_id, messages)
+        write_bytes_atomic(file_path, data)
     
     def _append_to_file(self, chat_id: str, message: ContextMessage) -> None:
-        """将消息追加到文件"""
+        """将消息以单行 JSON 追加到文件，并定期压缩文件"""
+        # 线程池中可能正在压缩（替换）同一个文件，不加锁时这里追加的行会丢失
+        with self._write_lock:
+            self._append_messages(chat_id, [message])
+
+    def _append_messages(self, chat_id: str, messages: List[ContextMessage]) -> None:
+        """一次 write 调用追加多条消息，每条一行"""
+        self._migrate_legacy_file(chat_id)
         file_path = self._get_file_path(chat_id)
         
         try:
-            # 读取现有消息
-            existing_messages = []
-            if os.path.exists(file_path):
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    existing_messages = json.load(f)
-            
-            # 添加新消息
-            existing_messages.append(asdict(message))
-            
-            # 保持文件大小限制
-            if len(existing_messages) > self.max_file_messages:
-                existing_messages = existing_messages[-self.max_file_messages:]
-            
-            # 写回文件
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(existing_messages, f, ensure_ascii=False, indent=2)
+            # 进程重启后先从已有文件恢复用户名表，避免重复写入
+            if chat_id not in self._user_tables and os.path.exists(file_path):
+                self._read_file(chat_id, 1)
+            data = self._encode_messages(chat_id, messages)
+            with open(file_path, 'ab', buffering=1 << 16) as f:
+                f.write(data)
+
+            # 每追加 compact_interval 条消息压缩一次，保持文件大小限制
+            appended = self._appends_since_compact.get(chat_id, 0) + len(messages)
+            if appended >= self.compact_interval:
+                self._compact(chat_id)
+                appended = 0
+            self._appends_since_compact[chat_id] = appended
                 
         except Exception as e:
             log.error(f"写入上下文文件失败 {file_path}: {e}")
+
+    def _compact(self, chat_id: str) -> None:
+        """只保留文件中最后 max_file_messages 条消息"""
+        file_path = self._get_file_path(chat_id)
+        if not os.path.exists(file_path):
+            return
+        try:
+            messages = self._read_file(chat_id, self.max_file_messages)
+            self._rewrite_file(chat_id, messages)
+            log.debug(f"已压缩上下文文件 {file_path}，保留 {len(messages)} 条消息")
+        except Exception as e:
+            log.error(f"压缩上下文文件失败 {file_path}: {e}")
     
     def _load_from_file(self, chat_id: str, count: int = None) -> List[ContextMessage]:
-        """从文件加载消息"""
+        """从文件加载消息，只解析末尾需要的消息行"""
+        self._migrate_legacy_file(chat_id)
         file_path = self._get_file_path(chat_id)
         
         if not os.path.exists(file_path):
             return []
         
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            messages = [ContextMessage(**msg_data) for msg_data in data]
-            
-            if count:
-                messages = messages[-count:]
-            
-            return messages
-            
+            return self._read_file(chat_id, count)
         except Exception as e:
             log.error(f"读取上下文文件失败 {file_path}: {e}")
             return []
@@ -183,7 +416,7 @@ class MessageContextManager:
         context_lines.append("【获取到的聊天上下文】")
         
         for msg in messages:
-            time_str = time.strftime("%H:%M:%S", time.localtime(msg.timestamp))
+            time_str = format_timestamp(msg.timestamp)
             context_lines.append(f"[{time_str}] {msg.username}({msg.user_id}): {msg.content}")
         
         context_lines.append("【上下文结束】")
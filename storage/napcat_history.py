@@ -3,18 +3,99 @@ import uuid
 import time
 import re
 import difflib
-from typing import Dict, List, Any, Optional
+import heapq
+from operator import itemgetter
+from typing import Any, AsyncIterator, Dict, List, Optional
+from common.time_utils import format_timestamp
 from logger import log
 
+try:
+    from rapidfuzz import fuzz
+    HAS_RAPIDFUZZ = True
+except ImportError:
+    HAS_RAPIDFUZZ = False
+
+# 字符相似度阈值，低于该值不计分
+SIMILARITY_THRESHOLD = 0.3
+
+
+def _similarity(query: str, content: str) -> float:
+    """计算两个字符串的相似度（0~1）。安装了 rapidfuzz 时使用其 C++ 实现，否则回退到 difflib。"""
+    if HAS_RAPIDFUZZ:
+        # score_cutoff 让 rapidfuzz 在确定低于阈值时提前结束，返回 0
+        return fuzz.ratio(query, content, score_cutoff=SIMILARITY_THRESHOLD * 100) / 100.0
+    return difflib.SequenceMatcher(None, query, content).ratio()
+
+
+def _compile_fuzzy_pattern(query: str) -> "re.Pattern":
+    """
+    将查询转换为按顺序包含所有字符的模糊正则。
+    字符之间使用 [^下一个字符]* 而不是 .*，每个字符都只匹配最左侧的出现位置，
+    匹配失败时不会产生回溯。
+    """
+    parts = [re.escape(query[0])]
+    for char in query[1:]:
+        escaped = re.escape(char)
+        parts.append(f"[^{escaped}]*{escaped}")
+    return re.compile(''.join(parts))
+
+
+def _compile_highlight_pattern(query: str) -> Optional["re.Pattern"]:
+    """
+    将查询中长度大于1的词合并为一个不区分大小写的正则，一次扫描即可标出所有词。
+    较长的词排在前面，重叠时优先匹配长词。没有可高亮的词时返回 None。
+    """
+    words = sorted({word for word in query.split() if len(word) > 1}, key=len, reverse=True)
+    if not words:
+        return None
+    return re.compile('|'.join(re.escape(word) for word in words), re.IGNORECASE)
+
+class _PendingRequest:
+    """等待Napcat响应的历史消息请求。"""
+    __slots__ = ('event', 'result_holder', 'group_id', 'params', 'created_at')
+
+    def __init__(self, event: asyncio.Event, result_holder: list, group_id: str, params: Dict[str, Any]):
+        self.event = event
+        self.result_holder = result_holder
+        self.group_id = group_id
+        self.params = params
+        self.created_at = time.monotonic()
+
+
 class NapcatHistoryManager:
     """使用Napcat API获取历史消息的管理器。"""
+
+    # 消息字典回收池的容量上限
+    MSG_POOL_SIZE = 2048
+    # 搜索索引缓存的有效期（秒）与最多缓存的 (群号, 天数) 组合数
+    SEARCH_INDEX_TTL = 60.0
+    SEARCH_INDEX_CACHE_SIZE = 8
+    # 待处理请求的最长保留时间（秒），超过后视为泄漏并清理
+    PENDING_REQUEST_MAX_AGE = 60.0
     
     def __init__(self):
-        # 存储待处理的请求：{echo_id: (event, result_holder, params)}
-        self._pending_requests: Dict[str, tuple] = {}
+        # 存储待处理的请求：{echo_id: _PendingRequest}
+        self._pending_requests: Dict[str, _PendingRequest] = {}
         # WebSocket发送器引用
         self._sender = None
-        
+        # 批量搜索时复用的消息字典
+        self._msg_pool: List[Dict[str, Any]] = []
+        # 正在进行中的最近消息请求：{(group_id, count, exclude_self, self_id): Task}
+        self._inflight: Dict[tuple, asyncio.Task] = {}
+        # 搜索用的消息与倒排索引缓存：{(group_id, days): (创建时间, 消息列表, 索引)}
+        self._index_cache: Dict[tuple, tuple] = {}
+        
+    def _register_request(self, echo_id: str, request: _PendingRequest):
+        """登记待处理请求，同时清理早已过期却仍未移除的记录。"""
+        if self._pending_requests:
+            expire_before = time.monotonic() - self.PENDING_REQUEST_MAX_AGE
+            stale = [echo for echo, req in self._pending_requests.items() if req.created_at < expire_before]
+            for echo in stale:
+                del self._pending_requests[echo]
+            if stale:
+                log.warning(f"🧹 NapcatHistoryManager: 清理了 {len(stale)} 个过期的待处理请求")
+        self._pending_requests[echo_id] = request
+
     def set_sender(self, sender):
         """设置WebSocket发送器。"""
         self._sender = sender
@@ -35,7 +116,31 @@ class NapcatHistoryManager:
             格式化后的消息列表
         """
         log.info(f"🔍 NapcatHistoryManager.get_recent_messages 被调用: group_id={group_id}, count={count}")
-        
+
+        # 相同参数的请求正在进行时，直接等待它的结果，不再重复请求
+        key = (group_id, count, exclude_self, self_id)
+        task = self._inflight.get(key)
+        if task is not None:
+            log.info(f"🔗 合并到进行中的历史消息请求: group_id={group_id}, count={count}")
+        else:
+            # 请求作为独立的任务运行，发起者与合并进来的调用者都通过 shield 等待：
+            # 任何一个调用者被取消都不会取消请求本身，其余调用者照常拿到结果
+            task = asyncio.ensure_future(self._fetch_recent_messages(group_id, count, exclude_self, self_id, timeout))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, key=key: self._finish_inflight(key, t))
+        # 每个调用者拿到各自的列表副本
+        return list(await asyncio.shield(task))
+
+    def _finish_inflight(self, key: tuple, task: asyncio.Task):
+        """请求任务结束后移除登记。"""
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # 所有调用者都已取消时没有人读取异常，避免 "Task exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    async def _fetch_recent_messages(self, group_id: str, count: int, exclude_self: bool, self_id: Optional[str], timeout: float) -> List[Dict[str, Any]]:
+        """向Napcat发送一次最近消息请求并等待响应。"""
         if not self._sender:
             log.error("❌ NapcatHistoryManager: WebSocket发送器未设置，无法获取历史消息")
             return []
@@ -49,7 +154,10 @@ class NapcatHistoryManager:
         # 参考好友列表逻辑：使用Event和result_holder
         event = asyncio.Event()
         result_holder = []
-        self._pending_requests[echo_id] = (event, result_holder, group_id, count, exclude_self, self_id)
+        self._register_request(echo_id, _PendingRequest(
+            event, result_holder, group_id,
+            {"count": count, "exclude_self": exclude_self, "self_id": self_id}
+        ))
         log.info(f"📝 已添加到待处理请求列表: {echo_id}")
         
         # 准备请求数据
@@ -109,9 +217,8 @@ class NapcatHistoryManager:
             log.error(f"❌ 获取历史消息时发生错误: {e}", exc_info=True)
             return []
         finally:
-            # 不在这里清理请求记录，让handle_history_response处理清理
-            # 避免清理时序问题
-            pass
+            # 收到响应时 handle_history_response 已移除记录；超时或出错时在这里移除
+            self._pending_requests.pop(echo_id, None)
     
     def handle_history_response(self, echo: str, response_data: Dict[str, Any]):
         """
@@ -120,13 +227,11 @@ class NapcatHistoryManager:
         """
         log.info(f"📥 NapcatHistoryManager: 收到响应，echo={echo}")
         
-        if echo not in self._pending_requests:
+        # 取出并清理请求记录
+        request = self._pending_requests.pop(echo, None)
+        if request is None:
             log.warning(f"⚠️ NapcatHistoryManager: 收到未知请求的响应，echo={echo}")
             return
-            
-        # 获取请求信息：(event, result_holder, group_id, count, exclude_self, self_id)
-        request_data = self._pending_requests[echo]
-        event, result_holder = request_data[:2]
         
         try:
             # 解析响应数据
@@ -134,28 +239,34 @@ class NapcatHistoryManager:
             log.info(f"✅ 收到 {len(messages)} 条原始历史消息，echo={echo}")
             
             # 将原始消息数据放入result_holder（参考好友列表逻辑）
-            result_holder.append(messages)
-            
-            # 设置事件通知等待的协程
-            event.set()
-            log.info(f"🚀 已通知等待协程，echo={echo}")
+            request.result_holder.append(messages)
                 
         except Exception as e:
             log.error(f"❌ 处理历史消息响应时出错，echo={echo}, error={e}", exc_info=True)
-            # 即使出错也要设置事件，避免无限等待
-            event.set()
         finally:
-            # 清理请求记录
-            if echo in self._pending_requests:
-                del self._pending_requests[echo]
-                log.debug(f"🧹 已清理请求记录: {echo}")
+            # 无论是否出错都设置事件，避免等待的协程无限等待
+            request.event.set()
+            log.info(f"🚀 已通知等待协程，echo={echo}")
     
-    def _format_message(self, raw_msg: Dict[str, Any]) -> Dict[str, Any]:
+    def _acquire_msg(self) -> Dict[str, Any]:
+        """从回收池取出一个空的消息字典，池为空时新建。"""
+        if self._msg_pool:
+            return self._msg_pool.pop()
+        return {}
+
+    def _release_msg(self, msg: Dict[str, Any]):
+        """清空消息字典并放回回收池，池满时直接丢弃。"""
+        if len(self._msg_pool) < self.MSG_POOL_SIZE:
+            msg.clear()
+            self._msg_pool.append(msg)
+
+    def _format_message(self, raw_msg: Dict[str, Any], out: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         将Napcat返回的原始消息格式化为统一格式。
         
         Args:
             raw_msg: Napcat返回的原始消息
+            out: 可选，用于写入结果的字典（会先被清空），为空时新建字典
             
         Returns:
             格式化后的消息
@@ -186,17 +297,30 @@ class NapcatHistoryManager:
         user_id = str(raw_msg.get('user_id', ''))
         username = sender.get('nickname', sender.get('card', f'用户{user_id}'))
         
-        return {
-            'chat_id': str(raw_msg.get('group_id', '')),
-            'chat_type': 'group',
-            'user_id': user_id,
-            'username': username,
-            'message_id': str(raw_msg.get('message_id', '')),
-            'content': content,
-            'raw_content': content,
-            'message_segments': message,
-            'timestamp': raw_msg.get('time', int(time.time()))
-        }
+        if out is None:
+            out = {}
+        else:
+            out.clear()
+        out['chat_id'] = str(raw_msg.get('group_id', ''))
+        out['chat_type'] = 'group'
+        out['user_id'] = user_id
+        out['username'] = username
+        out['message_id'] = str(raw_msg.get('message_id', ''))
+        out['content'] = content
+        out['raw_content'] = content
+        out['message_segments'] = message
+        out['timestamp'] = raw_msg.get('time', int(time.time()))
+        # 搜索时使用的小写内容和分词，只在格式化时计算一次
+        self._add_search_fields(out)
+        return out
+
+    @staticmethod
+    def _add_search_fields(msg: Dict[str, Any]):
+        """为消息补充搜索用的预计算字段：小写内容、小写用户名和词集合。"""
+        content_lower = msg.get('content', '').lower()
+        msg['_content_lower'] = content_lower
+        msg['_username_lower'] = msg.get('username', '').lower()
+        msg['_tokens'] = frozenset(content_lower.split())
     
     def format_context_for_ai(self, messages: List[Dict[str, Any]]) -> str:
         """
@@ -213,7 +337,7 @@ class NapcatHistoryManager:
 
         formatted_lines = []
         for msg in messages:
-            timestamp_str = time.strftime("%H:%M:%S", time.localtime(msg.get('timestamp', time.time())))
+            timestamp_str = format_timestamp(msg.get('timestamp', time.time()))
             formatted_lines.append(f"[{timestamp_str}] {msg.get('username')}({msg.get('user_id')}): {msg.get('content')}")
         
         return "【获取到的聊天上下文】\n" + "\n".join(formatted_lines) + "\n【上下文结束】"
@@ -232,17 +356,38 @@ class NapcatHistoryManager:
         Returns:
             大量历史消息列表
         """
+        all_messages = []
+        async for batch in self.iter_bulk_messages(group_id, days, max_messages, timeout):
+            all_messages.extend(batch)
+        return all_messages
+
+    async def iter_bulk_messages(self, group_id: str, days: int = 7, max_messages: int = 10000, timeout: float = 15.0) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        逐批获取大量历史消息，每收到一批就产出该批格式化后的消息，
+        调用方可以在等待下一批的同时处理已收到的消息。
+        
+        Args:
+            group_id: 群号
+            days: 获取多少天的历史（7天到730天即2年）
+            max_messages: 最大消息数量限制
+            timeout: 每批请求的超时时间
+            
+        Yields:
+            每批中位于时间范围内的消息列表（按时间倒序）
+        """
         log.info(f"🔍 NapcatHistoryManager.get_bulk_messages 被调用: group_id={group_id}, days={days}")
         
         if not self._sender:
             log.error("❌ NapcatHistoryManager: WebSocket发送器未设置，无法获取大量历史消息")
-            return []
+            return
         
         # 限制天数范围
         days = max(7, min(730, days))
         log.info(f"📅 开始获取 {days} 天的历史消息，最多 {max_messages} 条")
         
-        all_messages = []
+        total = 0
+        # 按 message_seq 翻页时，相邻批次的边界消息可能重复返回
+        seen_ids = set()
         batch_size = 100  # 每次获取100条消息
         current_message_seq = None
         iterations = 0
@@ -250,14 +395,14 @@ class NapcatHistoryManager:
         
         target_timestamp = time.time() - (days * 24 * 60 * 60)  # N天前的时间戳
         
-        while len(all_messages) < max_messages and iterations < max_iterations:
+        while total < max_messages and iterations < max_iterations:
             echo_id = f"bulk_search_{uuid.uuid4().hex[:8]}_{int(time.time())}"
             log.info(f"📋 生成批量请求ID（第{iterations+1}批）: {echo_id}")
             
             # 参考好友列表逻辑：使用Event和result_holder
             event = asyncio.Event()
             result_holder = []
-            self._pending_requests[echo_id] = (event, result_holder, group_id, batch_size)
+            self._register_request(echo_id, _PendingRequest(event, result_holder, group_id, {"count": batch_size}))
             
             # 准备请求数据
             request_data = {
@@ -274,6 +419,8 @@ class NapcatHistoryManager:
             if current_message_seq is not None:
                 request_data["params"]["message_seq"] = current_message_seq
             
+            valid_messages = []
+            finished = False
             try:
                 # 发送请求（使用send_json方法，参考好友列表）
                 await self._sender.send_json(request_data)
@@ -292,40 +439,42 @@ class NapcatHistoryManager:
                         break
                     
                     # 格式化并检查时间范围
-                    valid_messages = []
                     for msg in batch_messages:
-                        formatted_msg = self._format_message(msg)
+                        if total + len(valid_messages) >= max_messages:
+                            finished = True
+                            break
+                        formatted_msg = self._format_message(msg, self._acquire_msg())
                         msg_timestamp = formatted_msg.get('timestamp', 0)
+                        message_id = formatted_msg['message_id']
+                        if message_id in seen_ids:
+                            self._release_msg(formatted_msg)
+                            continue
+                        seen_ids.add(message_id)
                         
                         if msg_timestamp >= target_timestamp:
                             valid_messages.append(formatted_msg)
                         else:
-                            log.info(f"📅 达到时间边界，获取了 {len(all_messages)} 条消息")
-                            all_messages.extend(valid_messages)
-                            return all_messages[:max_messages]
-                    
-                    all_messages.extend(valid_messages)
+                            self._release_msg(formatted_msg)
+                            log.info(f"📅 达到时间边界，获取了 {total + len(valid_messages)} 条消息")
+                            finished = True
+                            break
                     
                     # 设置下一批的起始消息序号
-                    if batch_messages:
-                        last_msg = batch_messages[-1]
-                        current_message_seq = last_msg.get('message_id')
+                    last_msg = batch_messages[-1]
+                    current_message_seq = last_msg.get('message_id')
                     
-                    log.info(f"✅ 已累计获取 {len(all_messages)} 条消息（第 {iterations+1} 批）")
+                    log.info(f"✅ 已累计获取 {total + len(valid_messages)} 条消息（第 {iterations+1} 批）")
                     
                     # 如果这批获取的消息少于请求数量，说明没有更多了
                     if len(batch_messages) < batch_size:
                         log.info(f"📝 获取的消息数({len(batch_messages)})少于请求数({batch_size})，结束批量获取")
-                        break
+                        finished = True
                 else:
                     log.warning(f"⚠️ 批量获取请求已完成，但未收到数据（第{iterations+1}批）: {echo_id}")
                     break
                 
                 iterations += 1
                 
-                # 短暂延迟避免请求过于频繁
-                await asyncio.sleep(0.1)
-                
             except asyncio.TimeoutError:
                 log.error(f"⏰ 批量获取第 {iterations+1} 批消息超时")
                 break
@@ -333,14 +482,74 @@ class NapcatHistoryManager:
                 log.error(f"❌ 批量获取消息出错（第 {iterations+1} 批）: {e}", exc_info=True)
                 break
             finally:
-                # 不在这里清理请求记录，让handle_history_response处理清理
-                # 避免清理时序问题
-                pass
+                # 收到响应时 handle_history_response 已移除记录；超时或出错时在这里移除
+                self._pending_requests.pop(echo_id, None)
+            
+            if valid_messages:
+                total += len(valid_messages)
+                yield valid_messages
+            if finished:
+                break
+            
+            # 短暂延迟避免请求过于频繁
+            await asyncio.sleep(0.1)
         
-        log.info(f"🎯 批量获取完成，总计 {len(all_messages)} 条消息")
-        return all_messages[:max_messages]
+        log.info(f"🎯 批量获取完成，总计 {total} 条消息")
     
-    def search_messages(self, messages: List[Dict[str, Any]], query: str, max_results: int = 20) -> List[Dict[str, Any]]:
+    def _build_search_index(self, messages: List[Dict[str, Any]], index: Optional[Dict[str, List[int]]] = None,
+                            start: int = 0) -> Dict[str, List[int]]:
+        """
+        为消息列表建立字符倒排索引：{字符: [消息下标, ...]}。
+        传入已有的 index 和 start 时，只把 messages[start:] 追加到该索引中。
+        
+        search_messages 中每一项内容得分都要求内容与查询至少有一个相同字符，
+        所以用查询中各字符的倒排表取并集即可得到完整的候选集合。
+        """
+        if index is None:
+            index = {}
+        for i in range(start, len(messages)):
+            msg = messages[i]
+            if '_content_lower' not in msg:
+                self._add_search_fields(msg)
+            for char in set(msg['_content_lower']):
+                postings = index.get(char)
+                if postings is None:
+                    index[char] = [i]
+                else:
+                    postings.append(i)
+        return index
+
+    async def _get_search_messages(self, group_id: str, days: int) -> tuple:
+        """获取用于搜索的消息和倒排索引，在有效期内复用缓存。"""
+        key = (group_id, days)
+        now = time.monotonic()
+        cached = self._index_cache.get(key)
+        if cached is not None and now - cached[0] < self.SEARCH_INDEX_TTL:
+            log.info(f"NapcatHistoryManager: 复用 {len(cached[1])} 条已索引的消息")
+            return cached[1], cached[2]
+
+        # 边接收边建立索引，索引构建与等待下一批响应交错进行
+        bulk_messages: List[Dict[str, Any]] = []
+        index: Dict[str, List[int]] = {}
+        async for batch in self.iter_bulk_messages(group_id, days, max_messages=5000):
+            start = len(bulk_messages)
+            bulk_messages.extend(batch)
+            self._build_search_index(bulk_messages, index, start)
+
+        # 替换或淘汰的缓存项不再被引用，消息字典可以回收复用
+        old = self._index_cache.pop(key, None)
+        if old is None and len(self._index_cache) >= self.SEARCH_INDEX_CACHE_SIZE:
+            old = self._index_cache.pop(min(self._index_cache, key=lambda k: self._index_cache[k][0]))
+        if old is not None:
+            for msg in old[1]:
+                self._release_msg(msg)
+
+        if bulk_messages:
+            self._index_cache[key] = (now, bulk_messages, index)
+        return bulk_messages, index
+
+    def search_messages(self, messages: List[Dict[str, Any]], query: str, max_results: int = 20,
+                        index: Optional[Dict[str, List[int]]] = None) -> List[Dict[str, Any]]:
         """
         在消息列表中搜索相关内容。
         
@@ -348,6 +557,7 @@ class NapcatHistoryManager:
             messages: 要搜索的消息列表
             query: 搜索关键词
             max_results: 最大结果数量
+            index: 可选，_build_search_index 为 messages 建立的倒排索引，用于缩小候选范围
             
         Returns:
             匹配的消息列表，按相关度排序
@@ -359,10 +569,26 @@ class NapcatHistoryManager:
         results = []
         
         log.info(f"NapcatHistoryManager: 开始在 {len(messages)} 条消息中搜索: '{query}'")
+
+        if index is not None:
+            # 候选为内容与查询有相同字符的消息，加上用户名包含查询的消息；按原顺序遍历
+            candidates = set()
+            for char in set(query):
+                candidates.update(index.get(char, ()))
+            candidates.update(i for i, msg in enumerate(messages) if query in msg['_username_lower'])
+            messages = [messages[i] for i in sorted(candidates)]
+            log.debug(f"NapcatHistoryManager: 倒排索引筛选后剩余 {len(messages)} 条候选消息")
+
+        # 以下内容对本次搜索的所有消息都相同，只计算一次
+        fuzzy_regex = _compile_fuzzy_pattern(query)
+        query_words = query.split()
+        long_query_words = [word for word in query_words if len(word) > 2]
         
         for msg in messages:
-            content = msg.get('content', '').lower()
-            username = msg.get('username', '').lower()
+            if '_content_lower' not in msg:
+                self._add_search_fields(msg)
+            content = msg['_content_lower']
+            username = msg['_username_lower']
             
             # 计算相关度分数
             score = 0
@@ -371,56 +597,54 @@ class NapcatHistoryManager:
             if query in content:
                 score += 100
                 
-            # 2. 正则表达式匹配
-            try:
-                # 将用户输入转换为模糊正则表达式
-                fuzzy_pattern = '.*'.join(re.escape(char) for char in query)
-                if re.search(fuzzy_pattern, content):
-                    score += 50
-            except re.error:
-                pass
+            # 2. 模糊正则匹配（按顺序包含查询中的所有字符）
+            if fuzzy_regex.search(content):
+                score += 50
             
             # 3. 用户名匹配
             if query in username:
                 score += 30
                 
-            # 4. 字符相似度匹配（使用difflib）
-            similarity = difflib.SequenceMatcher(None, query, content).ratio()
-            if similarity > 0.3:  # 相似度阈值
+            # 4. 字符相似度匹配
+            similarity = _similarity(query, content) if content else 0.0
+            if similarity > SIMILARITY_THRESHOLD:
                 score += int(similarity * 40)
             
             # 5. 单词匹配
-            query_words = query.split()
-            content_words = content.split()
+            content_words = msg['_tokens']
             matching_words = sum(1 for word in query_words if word in content_words)
             if matching_words > 0:
                 score += matching_words * 15
             
             # 6. 包含关键词的部分匹配
-            for word in query_words:
-                if len(word) > 2 and word in content:
+            for word in long_query_words:
+                if word in content:
                     score += 10
             
             if score > 0:
-                msg_with_score = msg.copy()
-                msg_with_score['_search_score'] = score
-                msg_with_score['_search_highlight'] = self._highlight_matches(content, query)
-                results.append(msg_with_score)
-        
-        # 按分数排序并返回前N个结果
-        results.sort(key=lambda x: x['_search_score'], reverse=True)
-        top_results = results[:max_results]
+                results.append((score, msg))
+        
+        # 取分数最高的前N个结果（与稳定排序后截取的结果一致），只复制这些消息
+        top_results = []
+        highlight_pattern = _compile_highlight_pattern(query)
+        for score, msg in heapq.nlargest(max_results, results, key=itemgetter(0)):
+            msg_with_score = msg.copy()
+            msg_with_score['_search_score'] = score
+            # 只为返回的结果生成高亮，高亮正则每次搜索只编译一次
+            msg_with_score['_search_highlight'] = self._highlight_matches(msg['_content_lower'], query, highlight_pattern)
+            top_results.append(msg_with_score)
         
         log.info(f"NapcatHistoryManager: 搜索完成，找到 {len(top_results)} 个相关结果")
         return top_results
     
-    def _highlight_matches(self, content: str, query: str) -> str:
+    def _highlight_matches(self, content: str, query: str, pattern: Optional["re.Pattern"] = None) -> str:
         """
         在内容中高亮显示匹配的部分。
         
         Args:
             content: 原始内容
             query: 搜索查询
+            pattern: 可选，预先编译好的高亮正则（见 _compile_highlight_pattern）
             
         Returns:
             带高亮的内容
@@ -428,18 +652,13 @@ class NapcatHistoryManager:
         if not query:
             return content
         
-        # 简单的高亮实现，用【】包围匹配的内容
-        highlighted = content
-        
-        # 精确匹配高亮
-        words = query.split()
-        for word in words:
-            if len(word) > 1:
-                # 不区分大小写的替换
-                pattern = re.compile(re.escape(word), re.IGNORECASE)
-                highlighted = pattern.sub(f'【{word}】', highlighted)
+        if pattern is None:
+            pattern = _compile_highlight_pattern(query)
+            if pattern is None:
+                return content
         
-        return highlighted
+        # 用【】包围匹配的内容，所有词在一次扫描中完成替换
+        return pattern.sub(lambda m: f'【{m.group(0).lower()}】', content)
     
     async def search_context(self, group_id: str, query: str, days: int = 7, max_results: int = 15, self_id: Optional[str] = None) -> str:
         """
@@ -455,15 +674,15 @@ class NapcatHistoryManager:
             格式化的搜索结果
         """
         try:
-            # 获取大量历史消息
+            # 获取大量历史消息（短时间内重复搜索同一群时复用缓存的消息和索引）
             log.info(f"NapcatHistoryManager: 开始搜索 '{query}'，范围 {days} 天")
-            bulk_messages = await self.get_bulk_messages(group_id, days, max_messages=5000)
+            bulk_messages, index = await self._get_search_messages(group_id, days)
             
             if not bulk_messages:
                 return f"【搜索结果】\n未找到相关的聊天记录（搜索范围：{days}天）\n【搜索结束】"
             
             # 搜索匹配的消息
-            search_results = self.search_messages(bulk_messages, query, max_results)
+            search_results = self.search_messages(bulk_messages, query, max_results, index)
             
             if not search_results:
                 return f"【搜索结果】\n在 {len(bulk_messages)} 条消息中未找到与 '{query}' 相关的内容（搜索范围：{days}天）\n【搜索结束】"
@@ -474,7 +693,7 @@ class NapcatHistoryManager:
             result_lines.append("")
             
             for i, msg in enumerate(search_results, 1):
-                timestamp_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(msg.get('timestamp', time.time())))
+                timestamp_str = format_timestamp(msg.get('timestamp', time.time()), "%Y-%m-%d %H:%M:%S")
                 username = msg.get('username', '未知用户')
                 
                 # 如果是机器人自己的消息，标记为"你自己"
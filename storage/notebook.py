@@ -1,8 +1,13 @@
+import asyncio
+import atexit
 import json
 import os
-from typing import List, Dict, Optional, DefaultDict
+import threading
+from typing import List, Dict, Optional
 import time
-from collections import defaultdict
+
+from common.json_utils import dump_json_file, load_json_file
+from common.time_utils import format_timestamp
 
 # 默认的角色键，用于存储未指定角色时的笔记
 DEFAULT_ROLE_KEY = "__global__"
@@ -15,9 +20,27 @@ class AINotebook:
         :param notebook_file: 笔记持久化文件的路径。
         """
         self.notebook_file = notebook_file
-        # 使用 defaultdict 简化角色笔记列表的初始化
-        # self.notes 的结构: Dict[角色名_str, List[笔记_Dict]]
-        self.notes: DefaultDict[str, List[Dict]] = defaultdict(list)
+        # self.notes 的结构: Dict[角色名_str, Dict[笔记ID_int, 笔记_Dict]]，内层按添加顺序排列
+        # 使用普通 dict：只有写入时才通过 setdefault 创建角色条目，读取不存在的角色不会留下空条目
+        self.notes: Dict[str, Dict[int, Dict]] = {}
+        # 每个角色的下一个可用笔记 ID，增量维护，避免每次添加都扫描列表
+        self._next_id: Dict[str, int] = {}
+        # 每次笔记发生变化时递增，供外部缓存判断是否失效
+        self.version = 0
+        # 每个角色格式化后的上下文字符串，笔记变化时失效
+        self._ctx_cache: Dict[str, str] = {}
+        # 已删除笔记字典的回收池，添加笔记时复用，减少频繁记笔记时的分配
+        self.NOTE_POOL_SIZE = 128
+        self._note_pool: List[Dict] = []
+        # 延迟写盘：短时间内的多次修改合并为一次写入
+        self.SAVE_DELAY_SECONDS = 0.5
+        self._dirty = False
+        self._flush_timer: Optional[threading.Timer] = None
+        self._save_lock = threading.Lock()
+        # 在事件循环中修改笔记时，由单个后台任务合并写盘请求
+        self._persist_queue: Optional[asyncio.Queue] = None
+        self._persist_task: Optional[asyncio.Task] = None
+        atexit.register(self._flush_if_dirty)
         self._ensure_notebook_file()
         self._load_notes()
     
@@ -26,57 +49,138 @@ class AINotebook:
         os.makedirs(os.path.dirname(self.notebook_file), exist_ok=True)
         if not os.path.exists(self.notebook_file):
             # 初始化为空的 JSON 对象 {}，因为顶层是按角色组织的字典
-            with open(self.notebook_file, "w", encoding="utf-8") as f:
-                json.dump({}, f, ensure_ascii=False, indent=2)
+            dump_json_file(self.notebook_file, {})
     
     def _load_notes(self):
         """加载所有角色的笔记"""
         try:
-            with open(self.notebook_file, "r", encoding="utf-8") as f:
-                # 直接加载整个按角色组织的字典
-                data = json.load(f)
-                # 使用 defaultdict 更新，确保加载的数据是 List[Dict]
-                for role, notes_list in data.items():
-                    if isinstance(notes_list, list):
-                        # 简单验证下笔记结构，避免加载错误数据
-                        valid_notes = [note for note in notes_list if isinstance(note, dict) and 'id' in note and 'content' in note]
-                        self.notes[role].extend(valid_notes)
-                    else:
-                        print(f"[警告] 加载笔记时发现角色 '{role}' 的数据格式不正确，已忽略。")
+            # 直接加载整个按角色组织的字典
+            data = load_json_file(self.notebook_file, use_mmap=True)
+            # 文件中每个角色是 List[Dict]，加载时按笔记 ID 建立索引
+            for role, notes_list in data.items():
+                if isinstance(notes_list, list):
+                    # 简单验证下笔记结构，避免加载错误数据（JSON 解析只会产生普通 dict，用 type 判断即可）
+                    valid_notes = [note for note in notes_list if type(note) is dict and 'id' in note and 'content' in note]
+                    # 加载时按创建时间排序一次，之后笔记表始终按创建时间排列
+                    valid_notes.sort(key=lambda x: x.get("created_at", 0))
+                    # 一次性构建该角色的笔记表，直接赋值而不是逐条写入
+                    self.notes[role] = {note['id']: note for note in valid_notes}
+                    self._recompute_next_id(role)
+                else:
+                    print(f"[警告] 加载笔记时发现角色 '{role}' 的数据格式不正确，已忽略。")
         except FileNotFoundError:
             # 文件不存在是正常情况，确保目录存在即可
             self._ensure_notebook_file()
         except json.JSONDecodeError:
             print(f"[错误] 笔记本文件 '{self.notebook_file}' 格式错误，将使用空笔记。")
-            self.notes = defaultdict(list) # 重置为空
+            self.notes = {} # 重置为空
+            self._next_id.clear()
         except Exception as e:
             print(f"[错误] 加载笔记本时发生未知错误: {e}")
-            self.notes = defaultdict(list) # 出错时重置为空
+            self.notes = {} # 出错时重置为空
+            self._next_id.clear()
     
     def _save_notes(self):
-        """保存所有角色的笔记"""
+        """
+        标记笔记已修改并安排一次延迟写盘。
+        在事件循环中调用时交给后台写盘任务；否则使用定时器线程。
+        """
         try:
-            # 将 defaultdict 转换为普通 dict 以便 JSON 序列化
-            data_to_save = dict(self.notes)
-            with open(self.notebook_file, "w", encoding="utf-8") as f:
-                json.dump(data_to_save, f, ensure_ascii=False, indent=2)
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self._schedule_timer_flush()
+            return
+        # 不获取 _save_lock：写盘线程会在序列化和写文件期间一直持有它，事件循环不能等待磁盘 I/O。
+        # 单次赋值本身是原子的，而写盘前会先清除标记再生成快照，此后的修改会在下一次写盘时保存
+        self._dirty = True
+        if self._persist_task is None or self._persist_task.done():
+            self._persist_queue = asyncio.Queue()
+            self._persist_task = asyncio.create_task(self._persist_loop())
+        self._persist_queue.put_nowait(None)
+
+    async def _persist_loop(self):
+        """单个长期运行的写盘任务：收到修改通知后等待一个合并窗口，再在线程池中写盘一次"""
+        queue = self._persist_queue
+        loop = asyncio.get_running_loop()
+        while True:
+            await queue.get()
+            await asyncio.sleep(self.SAVE_DELAY_SECONDS)
+            # 窗口内的其余通知合并为这一次写盘
+            while not queue.empty():
+                queue.get_nowait()
+            await loop.run_in_executor(None, self._flush_if_dirty)
+
+    def _schedule_timer_flush(self):
+        """没有事件循环时，标记修改并在没有待执行的定时器时安排一次延迟写盘"""
+        with self._save_lock:
+            self._dirty = True
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.SAVE_DELAY_SECONDS, self._flush_if_dirty)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def _flush_if_dirty(self):
+        """如果有未保存的修改则立即写盘（定时器回调及进程退出时调用）"""
+        with self._save_lock:
+            self._flush_timer = None
+            if not self._dirty:
+                return
+            self._dirty = False
+            if not self._save_notes_now():
+                # 写盘失败时保留修改标记，退出时会再尝试一次
+                self._dirty = True
+
+    def _save_notes_now(self) -> bool:
+        """立即保存所有角色的笔记，返回是否成功"""
+        try:
+            # 在定时器线程中执行，先复制一份快照，避免序列化时笔记被修改
+            # 文件格式保持为 Dict[角色, List[笔记]]
+            data_to_save = {role: list(notes.values()) for role, notes in list(self.notes.items())}
+            # 一次性序列化为 bytes（优先使用 orjson），再整体写入临时文件并原子替换
+            dump_json_file(self.notebook_file, data_to_save, atomic=True)
+            return True
         except Exception as e:
             print(f"[错误] 保存笔记本出错: {e}")
+            return False
     
+    def _recompute_next_id(self, role: str):
+        """重新计算角色的下一个可用 ID（当前最大 ID 加 1）"""
+        role_notes = self.notes.get(role)
+        if role_notes:
+            self._next_id[role] = max(role_notes) + 1
+        else:
+            self._next_id.pop(role, None)
+
     def _get_next_id(self, role: str) -> int:
         """
         获取指定角色笔记列表的下一个可用 ID。
         ID 在每个角色的列表内是唯一的，从 1 开始。
         """
-        notes_list = self.notes[role]
-        if not notes_list:
-            return 1
-        # 找到当前列表中的最大 ID 并加 1
-        return max(note.get("id", 0) for note in notes_list) + 1
+        return self._next_id.get(role, 1)
+
+    def _acquire_note(self) -> Dict:
+        """从回收池取出一个空的笔记字典，池为空时新建。"""
+        if self._note_pool:
+            return self._note_pool.pop()
+        return {}
+
+    def _release_note(self, note: Dict):
+        """清空笔记字典并放回回收池，池满时直接丢弃。"""
+        if len(self._note_pool) >= self.NOTE_POOL_SIZE:
+            return
+        # 写盘线程持有锁时可能仍在序列化旧快照中的这个字典，此时不回收
+        if not self._save_lock.acquire(blocking=False):
+            return
+        try:
+            note.clear()
+            self._note_pool.append(note)
+        finally:
+            self._save_lock.release()
 
     def add_note(self, content: str, role: str = DEFAULT_ROLE_KEY) -> int:
         """
         为指定角色添加新笔记。
+        新笔记追加在该角色笔记表末尾，其创建时间不早于已有笔记，因此笔记表始终按创建时间排列。
 
         :param content: 笔记内容。
         :param role: 笔记所属的角色。默认为全局笔记。
@@ -84,12 +188,14 @@ class AINotebook:
         """
         try:
             note_id = self._get_next_id(role)
-            note = {
-                "id": note_id,
-                "content": content,
-                "created_at": int(time.time())
-            }
-            self.notes[role].append(note)
+            note = self._acquire_note()
+            note["id"] = note_id
+            note["content"] = content
+            note["created_at"] = int(time.time())
+            self.notes.setdefault(role, {})[note_id] = note
+            self._ctx_cache.pop(role, None)
+            self._next_id[role] = note_id + 1
+            self.version += 1
             self._save_notes()
             print(f"[信息] 已为角色 '{role}' 添加笔记 (ID: {note_id})")
             return note["id"]
@@ -106,17 +212,20 @@ class AINotebook:
         :return: 是否删除成功。
         """
         try:
-            notes_list = self.notes[role]
-            original_length = len(notes_list)
-            # 筛选掉指定 ID 的笔记
-            self.notes[role] = [note for note in notes_list if note.get("id") != note_id]
-            
-            if len(self.notes[role]) < original_length:
+            # 按 ID 直接移除笔记
+            role_notes = self.notes.get(role)
+            removed = role_notes.pop(note_id, None) if role_notes is not None else None
+            if removed is not None:
+                self._release_note(removed)
+                # 删除的是最大 ID 时重新计算，保持与按当前最大 ID 分配相同的行为
+                if note_id == self._next_id.get(role, 1) - 1:
+                    self._recompute_next_id(role)
+                self._ctx_cache.pop(role, None)
+                self.version += 1
                 self._save_notes()
                 print(f"[信息] 已从角色 '{role}' 删除笔记 (ID: {note_id})")
                 return True
-            else:
-                print(f"[信息] 在角色 '{role}' 中未找到要删除的笔记 (ID: {note_id})")
+            print(f"[信息] 在角色 '{role}' 中未找到要删除的笔记 (ID: {note_id})")
             return False
         except Exception as e:
             print(f"[错误] 从角色 '{role}' 删除笔记 (ID: {note_id}) 失败: {e}")
@@ -127,9 +236,11 @@ class AINotebook:
         获取指定角色的所有笔记。
 
         :param role: 要获取笔记的角色。默认为全局笔记。
-        :return: 该角色的笔记列表。
+        :return: 该角色的笔记列表（副本）。
         """
-        return self.notes[role]
+        role_notes = self.notes.get(role)
+        # 返回副本：删除或清空笔记时原字典会被清空并回收复用，调用方持有的列表不应随之改变
+        return [dict(note) for note in role_notes.values()] if role_notes else []
     
     def get_notes_as_context(self, role: str = DEFAULT_ROLE_KEY) -> str:
         """
@@ -138,23 +249,30 @@ class AINotebook:
         :param role: 要生成上下文的角色。默认为全局笔记。
         :return: 格式化后的上下文字符串，如果没有笔记则为空字符串。
         """
-        notes_list = self.notes[role]
-        if not notes_list:
+        cached = self._ctx_cache.get(role)
+        if cached is not None:
+            return cached
+
+        role_notes = self.notes.get(role)
+        if not role_notes:
             return ""
         
         role_display = "全局" if role == DEFAULT_ROLE_KEY else role
-        context = f"以下是为角色 **{role_display}** 记录的重要信息：\\n"
-        # 按创建时间排序可能更有用
-        sorted_notes = sorted(notes_list, key=lambda x: x.get("created_at", 0))
-
-        for note in sorted_notes:
+        parts = [f"以下是为角色 **{role_display}** 记录的重要信息："]
+        append = parts.append
+        # 笔记表已按创建时间排列（加载时排序、添加时追加），无需再排序
+        for note in role_notes.values():
             content = note.get("content", "内容丢失")
             created_at_ts = note.get("created_at")
-            created_at_str = time.strftime("%Y-%m-%d %H:%M", time.localtime(created_at_ts)) if created_at_ts else "未知时间"
+            created_at_str = format_timestamp(created_at_ts, "%Y-%m-%d %H:%M") if created_at_ts else "未知时间"
             # 使用笔记 ID 方便引用
-            context += f"- (ID: {note.get('id', 'N/A')}) {content} (记录于 {created_at_str})\\n"
-            
-        return context.strip()
+            append(f"- (ID: {note.get('id', 'N/A')}) {content} (记录于 {created_at_str})")
+
+        # 每一行（包括最后一行）之后都跟一个分隔符，与原先逐行拼接的结果一致
+        append("")
+        context = "\\n".join(parts)
+        self._ctx_cache[role] = context
+        return context
     
     def clear_notes_for_role(self, role: str = DEFAULT_ROLE_KEY):
         """
@@ -162,18 +280,37 @@ class AINotebook:
 
         :param role: 要清空笔记的角色。默认为全局笔记。
         """
-        if role in self.notes:
-            original_count = len(self.notes[role])
-            del self.notes[role] # 直接移除该角色的条目
+        if self.notes.get(role):
+            removed_notes = self.notes.pop(role) # 直接移除该角色的条目
+            original_count = len(removed_notes)
+            for note in removed_notes.values():
+                self._release_note(note)
+            self._next_id.pop(role, None)
+            self._ctx_cache.pop(role, None)
+            self.version += 1
             self._save_notes()
             print(f"[信息] 已清空角色 '{role}' 的 {original_count} 条笔记。")
         else:
+            # 没有笔记（或只剩空条目）时内存状态实际未变化，不触发写盘
+            self.notes.pop(role, None)
             print(f"[信息] 角色 '{role}' 没有笔记可清空。")
 
     def clear_all_notes(self):
         """清空所有角色的所有笔记"""
-        total_cleared = sum(len(notes) for notes in self.notes.values())
-        self.notes = defaultdict(list)
+        old_notes = self.notes
+        total_cleared = sum(len(notes) for notes in old_notes.values())
+        if total_cleared == 0:
+            # 本来就没有笔记，无需重写整个文件
+            self.notes = {}
+            print("[信息] 已清空所有角色的共 0 条笔记。")
+            return
+        self.notes = {}
+        for notes in old_notes.values():
+            for note in notes.values():
+                self._release_note(note)
+        self._next_id.clear()
+        self._ctx_cache.clear()
+        self.version += 1
         self._save_notes()
         print(f"[信息] 已清空所有角色的共 {total_cleared} 条笔记。")
 
@@ -9,7 +9,7 @@ import asyncio
 import json
 import time
 import uuid
-from storage.napcat_history import napcat_history_manager
+from storage.napcat_history import _PendingRequest, napcat_history_manager
 from llm import _check_for_tool_calls_sync, _execute_tool_call
 
 class MockWebSocketSender:
@@ -229,8 +229,11 @@ async def test_response_handling():
     test_echo = f"test_{uuid.uuid4().hex[:8]}_{int(time.time())}"
     
     # 手动添加pending请求
-    future = asyncio.Future()
-    napcat_history_manager._pending_requests[test_echo] = (future, '937194291', 5, True, '12519212')
+    event = asyncio.Event()
+    result_holder = []
+    napcat_history_manager._pending_requests[test_echo] = _PendingRequest(
+        event, result_holder, '937194291', {"count": 5, "exclude_self": True, "self_id": '12519212'}
+    )
     
     # 模拟响应数据
     mock_response_data = {
@@ -251,15 +254,11 @@ async def test_response_handling():
     print(f"📤 处理响应: echo={test_echo}")
     napcat_history_manager.handle_history_response(test_echo, mock_response_data)
     
-    # 检查future是否完成
-    if future.done():
-        try:
-            result = future.result()
-            print(f"✅ Future完成，结果: {len(result)} 条消息")
-        except Exception as e:
-            print(f"❌ Future异常: {e}")
+    # 检查事件是否已设置
+    if event.is_set() and result_holder:
+        print(f"✅ 请求完成，结果: {len(result_holder[0])} 条消息")
     else:
-        print("❌ Future未完成")
+        print("❌ 请求未完成")
     
     # 检查请求是否清理
     if test_echo not in napcat_history_manager._pending_requests:
@@ -0,0 +1,69 @@
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import requests
+
+import updater
+
+GITHUB_PREFIX = "https://github.com/"
+
+
+class FakeResponse:
+    """只实现 download_file 用到的部分：上下文管理与 close"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        pass
+
+
+class DownloadFileTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.download_path = os.path.join(self.tmp_dir, "update.zip")
+        self.connects = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def _open_mirror(self, full_url, extra_headers=None):
+        # 只有官方链接能连上，所有代理镜像都拒绝连接
+        self.connects.append((full_url, extra_headers))
+        if full_url.startswith(GITHUB_PREFIX):
+            return FakeResponse()
+        raise requests.exceptions.ConnectionError(f"refused: {full_url}")
+
+    def _stalling_write(self, r, download_path):
+        # 连接成功但下载到一半卡住：留下部分文件和 ETag，然后超时
+        with open(download_path, 'wb') as f:
+            f.write(b"partial")
+        with open(download_path + ".etag", 'w') as f:
+            f.write('"abc"')
+        raise requests.exceptions.ConnectionError("read timed out")
+
+    def test_stalled_mirror_does_not_loop_forever(self):
+        with mock.patch.object(updater, "_open_mirror", self._open_mirror), \
+                mock.patch.object(updater, "_write_response", self._stalling_write):
+            self.assertFalse(updater.download_file("owner/repo/update.zip", self.download_path))
+
+        github_connects = [url for url, _ in self.connects if url.startswith(GITHUB_PREFIX)]
+        # 中途失败的下载源不会在放弃续传后再次被尝试
+        self.assertEqual(len(github_connects), 1)
+        # 续传竞速与完整下载回退各最多一轮，连接次数有上限
+        self.assertLessEqual(len(self.connects), 3 * len(updater.DOWNLOAD_MIRRORS))
+        # 续传失败后丢弃了 ETag
+        self.assertFalse(os.path.exists(self.download_path + ".etag"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,26 +5,70 @@
 import re
 import asyncio
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Optional, List, Tuple
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Tuple, Union
 from logger import log
 
+# 正则中具有特殊含义的字符，遇到时字面前缀结束
+_REGEX_META_CHARS = frozenset(".^$*+?{}[]|()")
+
+
+def _literal_prefix(pattern: str) -> str:
+    r"""
+    提取正则模式开头的字面前缀，例如 r'\[get_context:(\d+)\]' 得到 '[get_context:'。
+    无法确定时返回较短的前缀或空字符串（空字符串表示不能用于预筛选）。
+    """
+    # 含有分支 | 时匹配不一定以前缀开头，保守起见不提取
+    if re.search(r"(?<!\\)\|", pattern):
+        return ""
+    prefix = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\":
+            if i + 1 >= len(pattern) or pattern[i + 1].isalnum():
+                # \d、\w 等字符类或反向引用，不是字面字符
+                break
+            literal = pattern[i + 1]
+            i += 2
+        elif char in _REGEX_META_CHARS:
+            break
+        else:
+            literal = char
+            i += 1
+        # 后面跟着量词时该字符可有可无，不能算作前缀
+        if i < len(pattern) and pattern[i] in "*?{":
+            break
+        prefix.append(literal)
+    return "".join(prefix)
+
 
 class BaseTool(ABC):
     """工具基础类"""
+
+    # parse_parameters 结果缓存的最大条目数
+    PARAMS_CACHE_SIZE = 256
     
-    def __init__(self, name: str, pattern: str, description: str):
+    def __init__(self, name: str, pattern: Union[str, re.Pattern], description: str):
         """
         初始化工具
         
         Args:
             name: 工具名称
-            pattern: 匹配模式（正则表达式）
+            pattern: 匹配模式（正则表达式字符串，或预先编译好的正则对象）
             description: 工具描述
         """
         self.name = name
-        self.pattern = pattern
         self.description = description
-        self._compiled_pattern = re.compile(pattern)
+        if isinstance(pattern, re.Pattern):
+            # 直接复用调用方编译好的对象；self.pattern 始终保存模式字符串，供合并正则使用
+            self._compiled_pattern = pattern
+            self.pattern = pattern.pattern
+        else:
+            self._compiled_pattern = re.compile(pattern)
+            self.pattern = pattern
+        # 模式固定时解析结果只取决于匹配到的文本：{match.group(0): params}
+        self._params_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
     
     def match(self, text: str) -> Optional[Dict[str, Any]]:
         """
@@ -38,13 +82,30 @@ class BaseTool(ABC):
         """
         match = self._compiled_pattern.search(text)
         if match:
-            params = self.parse_parameters(match)
-            return {
-                "tool": self.name,
-                "match": match,
-                "params": params
-            }
+            return self._build_match_info(match)
         return None
+
+    def _build_match_info(self, match: re.Match) -> Dict[str, Any]:
+        """根据本工具模式的匹配对象构建匹配信息字典"""
+        return {
+            "tool": self.name,
+            "match": match,
+            "params": self._cached_parse_parameters(match)
+        }
+
+    def _cached_parse_parameters(self, match: re.Match) -> Dict[str, Any]:
+        """带 LRU 缓存的 parse_parameters，模型重复输出相同的调用标记时直接复用解析结果"""
+        raw = match.group(0)
+        params = self._params_cache.get(raw)
+        if params is None:
+            params = self.parse_parameters(match)
+            self._params_cache[raw] = params
+            if len(self._params_cache) > self.PARAMS_CACHE_SIZE:
+                self._params_cache.popitem(last=False)
+        else:
+            self._params_cache.move_to_end(raw)
+        # 返回副本，避免调用方修改缓存中的参数
+        return dict(params)
     
     @abstractmethod
     def parse_parameters(self, match: re.Match) -> Dict[str, Any]:
@@ -82,24 +143,56 @@ class BaseTool(ABC):
         """
         return []
 
+    async def aclose(self):
+        """释放工具持有的资源（如网络会话），默认无需处理"""
+        pass
+
 
 class ToolRegistry:
     """工具注册表"""
     
     def __init__(self):
         self._tools: Dict[str, BaseTool] = {}
+        # 所有工具模式合并成的单个正则，每个工具对应一个命名分组，一次扫描即可找到工具调用
+        self._composite: Optional[re.Pattern] = None
+        self._group_tools: Dict[str, BaseTool] = {}
+        # 每个工具调用标记的字面前缀（如 '[get_context:'），文本中一个都不包含时无需运行正则
+        self._literal_prefixes: Tuple[str, ...] = ()
+    
+    def _rebuild_composite(self):
+        """根据当前已注册的工具重建合并正则"""
+        self._group_tools = {f"_tool{i}": tool for i, tool in enumerate(self._tools.values())}
+        prefixes = tuple(_literal_prefix(tool.pattern) for tool in self._tools.values())
+        # 只要有一个工具没有字面前缀，就不能用前缀预筛选
+        self._literal_prefixes = prefixes if all(prefixes) else ()
+        if not self._group_tools:
+            self._composite = None
+            return
+        self._composite = re.compile("|".join(
+            f"(?P<{group}>{tool.pattern})" for group, tool in self._group_tools.items()
+        ))
     
     def register(self, tool: BaseTool):
         """注册工具"""
         self._tools[tool.name] = tool
+        self._rebuild_composite()
         log.debug(f"ToolRegistry: 注册工具 '{tool.name}'")
     
     def unregister(self, tool_name: str):
         """注销工具"""
         if tool_name in self._tools:
             del self._tools[tool_name]
+            self._rebuild_composite()
             log.debug(f"ToolRegistry: 注销工具 '{tool_name}'")
     
+    async def aclose(self):
+        """关闭所有已注册工具持有的资源，在程序退出时调用"""
+        for tool in list(self._tools.values()):
+            try:
+                await tool.aclose()
+            except Exception as e:
+                log.error(f"ToolRegistry: 关闭工具 '{tool.name}' 时出错: {e}")
+
     def get_tool(self, tool_name: str) -> Optional[BaseTool]:
         """获取工具"""
         return self._tools.get(tool_name)
@@ -118,12 +211,24 @@ class ToolRegistry:
         Returns:
             (工具对象, 匹配信息) 或 None
         """
-        for tool in self._tools.values():
-            match_info = tool.match(text)
-            if match_info:
-                log.info(f"ToolRegistry: 检测到工具调用 '{tool.name}'")
-                return tool, match_info
-        return None
+        if self._composite is None:
+            return None
+        start = 0
+        if self._literal_prefixes:
+            # 绝大多数回复不含工具调用，先用字符串查找快速排除，并从最早的前缀处开始匹配
+            positions = [pos for pos in (text.find(prefix) for prefix in self._literal_prefixes) if pos >= 0]
+            if not positions:
+                return None
+            start = min(positions)
+        composite_match = self._composite.search(text, start)
+        if not composite_match:
+            return None
+        # 外层命名分组最后闭合，lastgroup 即为匹配到的工具
+        tool = self._group_tools[composite_match.lastgroup]
+        # 用工具自身的正则在同一位置重新匹配，保证分组编号与 parse_parameters 的预期一致
+        match = tool._compiled_pattern.match(text, composite_match.start())
+        log.info(f"ToolRegistry: 检测到工具调用 '{tool.name}'")
+        return tool, tool._build_match_info(match)
     
     async def execute_tool_call(self, text: str, context: Dict[str, Any]) -> Tuple[Optional[str], bool]:
         """
@@ -15,7 +15,8 @@ class GetContextTool(BaseTool):
     def __init__(self):
         super().__init__(
             name="get_context",
-            pattern=r'\[get_context:(\d+)\]',
+            # 数量只接受 1-4 位 ASCII 数字，超出部分本来也会被截断到 100
+            pattern=r'\[get_context:((?a:\d{1,4}))\]',
             description="上下文获取工具：当用户询问关于“上面”、“之前”、“刚才大家聊的”等涉及历史聊天记录的问题时，你可以使用 [get_context:N] 来获取之前的N条消息。"
         )
     
@@ -69,7 +70,8 @@ class SearchContextTool(BaseTool):
     def __init__(self):
         super().__init__(
             name="search_context",
-            pattern=r'\[search_context:([^:\]]+)(?::(\d+))?\]',
+            # 限制关键词与天数的长度，避免超长输出上的无界匹配
+            pattern=r'\[search_context:([^:\]]{1,200})(?::((?a:\d{1,4})))?\]',
             description="历史记录搜索工具：当用户询问很久之前的话题、想找某个特定内容或者需要回忆以前讨论过的事情时，你可以使用搜索功能来查找相关的历史聊天记录。"
         )
     
@@ -3,20 +3,143 @@
 """
 
 import re
+import time
 import aiohttp
 import asyncio
-from typing import Dict, Any, Optional, List, Tuple
+import threading
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Any, Optional, List, Tuple, Union
 from .base import BaseTool
+from common.json_utils import json_loads
 from logger import log
 
+# 工具调用标记的正则，在模块加载时编译一次
+_SEARCH_RE = re.compile(r'\[search_web:([^:\]]+)(?::(\d+))?\]')
+_PARSE_RE = re.compile(r'\[parse_web:(https?://[^\s\]]+)\]')
+# 网页解析结果中的标题行，以及查找标题的范围
+_TITLE_RE = re.compile(r'^title:.*$', re.MULTILINE)
+_TITLE_SCAN_LIMIT = 4096
 
-class AggregateSearchTool(BaseTool):
+def _trunc(text: str, limit: int) -> str:
+    """超过 limit 个字符时截断，并以省略号结尾（总长度为 limit）"""
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+
+# 所有网络工具共用的会话与连接池（目标多为同一个 API 主机，共用后连接可以跨工具复用）
+_shared_session: Optional[aiohttp.ClientSession] = None
+# 会话绑定创建时的事件循环，只能在该循环中使用和关闭
+_shared_session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _discard_session(session: aiohttp.ClientSession, loop: Optional[asyncio.AbstractEventLoop]):
+    """释放属于其他事件循环的会话：该循环仍在运行时交给它关闭，已经停止时无法再关闭，只能丢弃"""
+    if session.closed:
+        return
+    if loop is not None and loop.is_running():
+        asyncio.run_coroutine_threadsafe(session.close(), loop)
+    else:
+        log.warning("网络工具: 共享会话所属的事件循环已停止，无法关闭该会话")
+
+
+async def get_shared_session() -> Optional[aiohttp.ClientSession]:
+    """
+    返回当前事件循环可用的共享会话，不存在或已关闭时新建。
+    只在主线程的事件循环（程序主循环）中共享；其他线程中的事件循环多为 asyncio.run 创建的临时循环，
+    循环结束后会话无法再关闭，此时返回 None，由调用方使用一次性会话。
+    """
+    global _shared_session, _shared_session_loop
+    loop = asyncio.get_running_loop()
+    # 检查与创建之间没有 await，同一事件循环内不会并发创建，无需加锁
+    if _shared_session is not None and not _shared_session.closed and _shared_session_loop is loop:
+        return _shared_session
+    if threading.current_thread() is not threading.main_thread():
+        return None
+    if _shared_session is not None:
+        # 主线程换了新的事件循环，旧会话不能在这里 await 关闭
+        _discard_session(_shared_session, _shared_session_loop)
+    connector = aiohttp.TCPConnector(
+        limit=64,
+        limit_per_host=16,
+        ttl_dns_cache=300,
+        keepalive_timeout=60,
+        enable_cleanup_closed=True,
+    )
+    _shared_session = aiohttp.ClientSession(connector=connector)
+    _shared_session_loop = loop
+    return _shared_session
+
+
+async def close_shared_session():
+    """关闭共享的会话及其连接池，可重复调用"""
+    global _shared_session, _shared_session_loop
+    session = _shared_session
+    loop = _shared_session_loop
+    _shared_session = None
+    _shared_session_loop = None
+    if session is None or session.closed:
+        return
+    # 只能在会话所属的事件循环中 await close()
+    if loop is asyncio.get_running_loop():
+        await session.close()
+    else:
+        _discard_session(session, loop)
+
+
+class _HttpTool(BaseTool):
+    """需要发起 HTTP 请求的工具基类：使用模块级共享会话，保持连接长连复用，并短时缓存成功的结果"""
+
+    # 成功结果的缓存有效期（秒）与最大条目数，子类可覆盖
+    RESULT_CACHE_TTL = 300.0
+    RESULT_CACHE_SIZE = 256
+
+    def __init__(self, name: str, pattern: Union[str, re.Pattern], description: str):
+        super().__init__(name=name, pattern=pattern, description=description)
+        # {缓存键: (写入时间, 格式化后的结果)}，按写入顺序排列，最早写入的在最前
+        self._result_cache: Dict[Any, Tuple[float, str]] = {}
+
+    def _get_cached_result(self, key: Any) -> Optional[str]:
+        """返回未过期的缓存结果，过期则删除"""
+        cached = self._result_cache.get(key)
+        if cached is None:
+            return None
+        if time.monotonic() - cached[0] < self.RESULT_CACHE_TTL:
+            return cached[1]
+        del self._result_cache[key]
+        return None
+
+    def _store_result(self, key: Any, result: str):
+        """缓存一条成功的结果，超出容量时淘汰最早写入的条目"""
+        # 先删除再插入，保证字典顺序与写入时间一致
+        self._result_cache.pop(key, None)
+        if len(self._result_cache) >= self.RESULT_CACHE_SIZE:
+            del self._result_cache[next(iter(self._result_cache))]
+        self._result_cache[key] = (time.monotonic(), result)
+
+    @asynccontextmanager
+    async def _session(self) -> AsyncIterator[aiohttp.ClientSession]:
+        """
+        提供本次请求使用的会话：优先使用共享会话；当前事件循环无法复用共享会话时
+        （例如在后台线程中经 asyncio.run 临时执行工具），使用一次性会话并在请求结束后关闭。
+        """
+        shared = await get_shared_session()
+        if shared is not None:
+            yield shared
+            return
+        async with aiohttp.ClientSession() as session:
+            yield session
+
+    async def aclose(self):
+        """关闭共享的会话（多个工具重复调用时只会真正关闭一次）"""
+        await close_shared_session()
+
+
+class AggregateSearchTool(_HttpTool):
     """智能聚合搜索工具"""
     
     def __init__(self):
         super().__init__(
             name="aggregate_search",
-            pattern=r'\[search_web:([^:\]]+)(?::(\d+))?\]',
+            pattern=_SEARCH_RE,
             description="智能聚合搜索工具：当用户询问需要实时信息、最新资讯或者需要搜索互联网内容时，可以使用此工具进行多引擎聚合搜索。"
         )
         self.api_url = "https://uapis.cn/api/v1/search/aggregate"
@@ -36,6 +159,12 @@ class AggregateSearchTool(BaseTool):
         """执行聚合搜索"""
         query = params["query"]
         limit = params["limit"]
+
+        cache_key = (query.lower(), limit)
+        cached = self._get_cached_result(cache_key)
+        if cached is not None:
+            log.debug(f"AggregateSearchTool: 命中缓存 '{query}'")
+            return cached, True
         
         try:
             log.debug(f"AggregateSearchTool: 搜索 '{query}'，获取 {limit} 条结果")
@@ -52,14 +181,18 @@ class AggregateSearchTool(BaseTool):
             }
             
             # 发送API请求
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(self.api_url, json=request_data) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return self._format_search_results(data, query), True
-                    else:
-                        log.error(f"AggregateSearchTool: API请求失败，状态码: {response.status}")
-                        return f"搜索请求失败，状态码: {response.status}", False
+            timeout = aiohttp.ClientTimeout(total=self.timeout)
+            async with self._session() as session, \
+                    session.post(self.api_url, json=request_data, timeout=timeout) as response:
+                if response.status == 200:
+                    # 使用 json_loads（优先 orjson）解析响应
+                    data = await response.json(loads=json_loads)
+                    result = self._format_search_results(data, query)
+                    self._store_result(cache_key, result)
+                    return result, True
+                else:
+                    log.error(f"AggregateSearchTool: API请求失败，状态码: {response.status}")
+                    return f"搜索请求失败，状态码: {response.status}", False
         
         except asyncio.TimeoutError:
             log.error("AggregateSearchTool: 请求超时")
@@ -77,33 +210,21 @@ class AggregateSearchTool(BaseTool):
         if not results:
             return f"【网络搜索结果】\n关键词: '{query}'\n未找到相关结果\n【搜索结束】"
         
-        # 格式化结果
-        formatted_lines = []
-        formatted_lines.append(f"【网络搜索结果】关键词: '{query}' | 找到: {total_results} 条 | 耗时: {process_time}ms")
-        formatted_lines.append("")
-        
+        # 每条结果用一个模板字符串生成，最后整体拼接
+        parts = [f"【网络搜索结果】关键词: '{query}' | 找到: {total_results} 条 | 耗时: {process_time}ms\n\n"]
+        append = parts.append
         for i, result in enumerate(results[:10], 1):  # 最多显示10条
-            title = result.get("title", "无标题")
-            url = result.get("url", "")
-            snippet = result.get("snippet", "无描述")
-            domain = result.get("domain", "")
-            score = result.get("score", 0)
-            
             # 限制标题和描述长度
-            if len(title) > 80:
-                title = title[:77] + "..."
-            if len(snippet) > 120:
-                snippet = snippet[:117] + "..."
-            
-            formatted_lines.append(f"{i}. {title}")
-            formatted_lines.append(f"   来源: {domain}")
-            formatted_lines.append(f"   描述: {snippet}")
-            formatted_lines.append(f"   链接: {url}")
-            formatted_lines.append(f"   相关度: {score:.1f}")
-            formatted_lines.append("")
+            append(
+                f"{i}. {_trunc(result.get('title', '无标题'), 80)}\n"
+                f"   来源: {result.get('domain', '')}\n"
+                f"   描述: {_trunc(result.get('snippet', '无描述'), 120)}\n"
+                f"   链接: {result.get('url', '')}\n"
+                f"   相关度: {result.get('score', 0):.1f}\n\n"
+            )
         
-        formatted_lines.append("【搜索结束】")
-        return "\n".join(formatted_lines)
+        append("【搜索结束】")
+        return "".join(parts)
     
     def get_usage_examples(self) -> List[str]:
         """获取使用示例"""
@@ -114,13 +235,20 @@ class AggregateSearchTool(BaseTool):
         ]
 
 
-class WebParserTool(BaseTool):
+class WebParserTool(_HttpTool):
     """网页解析工具"""
+
+    # 网页内容变化较慢，解析结果缓存 30 分钟
+    RESULT_CACHE_TTL = 1800.0
+    # 返回给模型的最大字符数
+    MAX_CONTENT_LENGTH = 2000
+    # 最多读取的响应字节数：足以容纳 MAX_CONTENT_LENGTH 个最长 4 字节的字符并判断是否需要截断
+    MAX_FETCH_BYTES = 16 * 1024
     
     def __init__(self):
         super().__init__(
             name="web_parser",
-            pattern=r'\[parse_web:(https?://[^\s\]]+)\]',
+            pattern=_PARSE_RE,
             description="网页解析工具：当用户提供网页链接并希望了解页面内容时，可以使用此工具将网页转换为易读的文本格式。"
         )
         self.api_url = "https://uapis.cn/api/v1/web/tomarkdown"
@@ -134,6 +262,11 @@ class WebParserTool(BaseTool):
     async def execute(self, params: Dict[str, Any], context: Dict[str, Any]) -> Tuple[Optional[str], bool]:
         """执行网页解析"""
         url = params["url"]
+
+        cached = self._get_cached_result(url)
+        if cached is not None:
+            log.debug(f"WebParserTool: 命中缓存 '{url}'")
+            return cached, True
         
         try:
             log.debug(f"WebParserTool: 解析网页 '{url}'")
@@ -142,14 +275,17 @@ class WebParserTool(BaseTool):
             request_params = {"url": url}
             
             # 发送API请求
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.get(self.api_url, params=request_params) as response:
-                    if response.status == 200:
-                        markdown_content = await response.text()
-                        return self._format_web_content(markdown_content, url), True
-                    else:
-                        log.error(f"WebParserTool: API请求失败，状态码: {response.status}")
-                        return f"网页解析失败，状态码: {response.status}", False
+            timeout = aiohttp.ClientTimeout(total=self.timeout)
+            async with self._session() as session, \
+                    session.get(self.api_url, params=request_params, timeout=timeout) as response:
+                if response.status == 200:
+                    markdown_content = await self._read_limited(response)
+                    result = self._format_web_content(markdown_content, url)
+                    self._store_result(url, result)
+                    return result, True
+                else:
+                    log.error(f"WebParserTool: API请求失败，状态码: {response.status}")
+                    return f"网页解析失败，状态码: {response.status}", False
         
         except asyncio.TimeoutError:
             log.error("WebParserTool: 请求超时")
@@ -158,20 +294,28 @@ class WebParserTool(BaseTool):
             log.error(f"WebParserTool: 解析网页时出错: {e}")
             return f"网页解析时发生错误: {str(e)}", False
     
+    async def _read_limited(self, response: aiohttp.ClientResponse) -> str:
+        """分块读取响应体，读够 MAX_FETCH_BYTES 后停止，避免为超长页面下载和解码用不到的内容"""
+        buf = bytearray()
+        async for chunk in response.content.iter_chunked(4096):
+            buf.extend(chunk)
+            if len(buf) >= self.MAX_FETCH_BYTES:
+                break
+        # 截断处可能切开一个多字节字符，忽略不完整的尾部即可（超出部分本来也会被截掉）
+        return buf.decode(response.charset or 'utf-8', errors='ignore')
+
     def _format_web_content(self, content: str, url: str) -> str:
         """格式化网页内容"""
-        # 提取标题
+        # 提取标题：标题位于文档开头的元信息中，只在前 4KB 内查找第一行 title:，不拆分整篇文档
         title_line = ""
-        lines = content.split('\n')
-        for line in lines:
-            if line.startswith('title:'):
-                title = line.replace('title:', '').strip()
-                if title:
-                    title_line = f"标题: {title}\n"
-                break
+        match = _TITLE_RE.search(content, 0, _TITLE_SCAN_LIMIT)
+        if match:
+            title = match.group(0).replace('title:', '').strip()
+            if title:
+                title_line = f"标题: {title}\n"
         
         # 限制内容长度，避免过长
-        max_length = 2000
+        max_length = self.MAX_CONTENT_LENGTH
         if len(content) > max_length:
             content = content[:max_length] + "\n\n[内容过长，已截断...]"
         
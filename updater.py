@@ -1,11 +1,17 @@
 import os
 import sys
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import zipfile
 import shutil
 import json
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from packaging.version import parse as parse_version
 from logger import log
+from common.json_utils import json_loads
 
 try:
     from tqdm import tqdm
@@ -17,6 +23,25 @@ except ImportError:
 API_URL = "https://webhook.sdjz.wiki/api/latest_release_info"
 VERSION_FILE = "VERSION.txt"
 CONFIG_DIR = "config"
+# 最新版本信息的本地缓存，配合 ETag 在版本未变化时跳过响应体下载
+UPDATE_CACHE_DIR = ".cache"
+RELEASE_INFO_CACHE = os.path.join(UPDATE_CACHE_DIR, "latest_release.json")
+RELEASE_ETAG_FILE = os.path.join(UPDATE_CACHE_DIR, "latest_release.etag")
+# 上次检查的时间与当时的最新版本；间隔内且本地已是最新时跳过网络请求
+UPDATE_META_FILE = os.path.join(UPDATE_CACHE_DIR, "update_meta.json")
+UPDATE_CHECK_INTERVAL = 3600
+
+# 检查更新与下载共用的会话：复用到同一主机的连接，并对临时性的 5xx 错误自动重试
+_retry = Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=_retry))
+_SESSION.mount("http://", HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=_retry))
+
+# 下载时每次读取的块大小：超过约 100KB 后循环开销已可忽略，
+# 而每块都要读满才返回，块过大时慢速连接上的进度条会长时间不刷新
+DOWNLOAD_CHUNK_SIZE = 128 * 1024
+# 下载文件的写缓冲区大小：默认 8KB 的缓冲区对 128KB 的块不起作用，1MB 可以把多个块合并为一次写入
+DOWNLOAD_WRITE_BUFFER = 1024 * 1024
 
 # 备用下载镜像模板
 DOWNLOAD_MIRRORS = [
@@ -34,44 +59,221 @@ def get_current_version():
     with open(VERSION_FILE, 'r') as f:
         return parse_version(f.read().strip())
 
+def _load_cached_release_info():
+    """读取缓存的版本信息及其 ETag，缓存不存在或损坏时返回 (None, None)"""
+    try:
+        with open(RELEASE_ETAG_FILE, 'r', encoding='utf-8') as f:
+            etag = f.read().strip()
+        with open(RELEASE_INFO_CACHE, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None, None
+    if not etag or not isinstance(info, dict):
+        return None, None
+    return info, etag
+
+def _save_release_cache(info, etag):
+    """缓存版本信息和 ETag；响应没有 ETag 时删除旧的 ETag，避免与新内容不匹配"""
+    try:
+        os.makedirs(UPDATE_CACHE_DIR, exist_ok=True)
+        if not etag:
+            if os.path.exists(RELEASE_ETAG_FILE):
+                os.remove(RELEASE_ETAG_FILE)
+            return
+        with open(RELEASE_INFO_CACHE, 'w', encoding='utf-8') as f:
+            json.dump(info, f, ensure_ascii=False)
+        with open(RELEASE_ETAG_FILE, 'w', encoding='utf-8') as f:
+            f.write(etag)
+    except OSError as e:
+        log.warning(f"缓存版本信息失败: {e}")
+
+def _recently_checked(current_v):
+    """间隔时间内检查过更新，且当时的最新版本不高于本地版本时返回 True"""
+    try:
+        with open(UPDATE_META_FILE, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        elapsed = time.time() - float(meta.get("last_checked_at", 0))
+        latest_v_str = meta.get("latest_version")
+        if not latest_v_str or not 0 <= elapsed < UPDATE_CHECK_INTERVAL:
+            return False
+        return parse_version(latest_v_str) <= current_v
+    except Exception:
+        # 元数据缺失或损坏时正常检查
+        return False
+
+def _record_check(latest_v_str):
+    """记录本次检查的时间与最新版本"""
+    try:
+        os.makedirs(UPDATE_CACHE_DIR, exist_ok=True)
+        with open(UPDATE_META_FILE, 'w', encoding='utf-8') as f:
+            json.dump({"last_checked_at": time.time(), "latest_version": latest_v_str}, f)
+    except OSError as e:
+        log.warning(f"记录更新检查时间失败: {e}")
+
 def get_latest_release_info():
-    """从API获取最新版本信息"""
+    """从API获取最新版本信息，版本信息未变化（304）时直接使用本地缓存"""
+    cached_info, etag = _load_cached_release_info()
+    headers = {'If-None-Match': etag} if etag else {}
     try:
-        response = requests.get(API_URL, timeout=10)
+        response = _SESSION.get(API_URL, headers=headers, timeout=10)
+        if response.status_code == 304 and cached_info is not None:
+            log.info("最新版本信息未变化，使用本地缓存。")
+            return cached_info
         response.raise_for_status() # 如果HTTP错误，则抛出异常
-        return response.json()
+        # 直接解析响应的原始字节（优先 orjson），省去解码为字符串的一步
+        info = json_loads(response.content)
+        _save_release_cache(info, response.headers.get('ETag'))
+        return info
     except requests.exceptions.RequestException as e:
         log.error(f"获取最新版本信息失败: {e}")
         return None
+    except ValueError as e:
+        log.error(f"解析最新版本信息失败: {e}")
+        return None
+
+def _open_mirror(full_url, extra_headers=None):
+    """连接单个下载源，返回状态码正常的流式响应"""
+    headers = dict(extra_headers) if extra_headers else {}
+    if "api.github.com" in full_url:
+        headers['Accept'] = 'application/octet-stream'
+    r = _SESSION.get(full_url, headers=headers, stream=True, timeout=60)
+    try:
+        r.raise_for_status()
+    except Exception:
+        r.close()
+        raise
+    return r
+
+def _close_response(future):
+    """关闭竞速落选的请求已经拿到的响应，释放连接"""
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+def _race_mirrors(urls, failed, headers=None):
+    """
+    同时连接所有下载源，返回最先成功响应的 (url, response)，全部失败时返回 (None, None)。
+    连接失败的下载源会加入 failed。
+    """
+    executor = ThreadPoolExecutor(max_workers=len(urls))
+    futures = {executor.submit(_open_mirror, url, headers): url for url in urls}
+    winner = None
+    try:
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                future.result()
+            except requests.exceptions.RequestException as e:
+                log.error(f"连接 {url} 失败: {e}")
+                failed.add(url)
+                continue
+            except Exception as e:
+                log.error(f"连接 {url} 时发生意外错误: {e}")
+                failed.add(url)
+                continue
+            winner = future
+            break
+    finally:
+        # 不等待其余仍在连接中的请求，它们完成后由回调关闭
+        for future in futures:
+            if future is not winner:
+                future.add_done_callback(_close_response)
+        executor.shutdown(wait=False)
+    if winner is None:
+        return None, None
+    return futures[winner], winner.result()
+
+def _resume_headers(download_path):
+    """
+    根据上次中断留下的部分文件生成续传请求头，没有可续传的内容时返回 None。
+    只有记录了强 ETag 时才续传，If-Range 保证文件已变化时服务器返回完整内容而不是错误的片段。
+    """
+    etag_path = download_path + ".etag"
+    if not os.path.exists(download_path) or not os.path.exists(etag_path):
+        return None
+    pos = os.path.getsize(download_path)
+    with open(etag_path, 'r') as f:
+        etag = f.read().strip()
+    if pos == 0 or not etag or etag.startswith('W/'):
+        return None
+    return {'Range': f'bytes={pos}-', 'If-Range': etag}
+
+def _write_response(r, download_path):
+    """把流式响应写入文件，带进度条。206 响应追加到已有的部分文件之后"""
+    etag_path = download_path + ".etag"
+    if r.status_code == 206:
+        mode = 'ab'
+        pos = os.path.getsize(download_path)
+        content_range = r.headers.get('Content-Range', '')
+        if not content_range.startswith(f'bytes {pos}-'):
+            raise IOError(f"续传响应的范围与本地文件不符: {content_range}")
+        log.info(f"从第 {pos} 字节继续下载")
+    else:
+        mode = 'wb'
+        pos = 0
+        # 记录新文件的 ETag，下载中断后可以据此续传
+        etag = r.headers.get('ETag')
+        if etag:
+            with open(etag_path, 'w') as f:
+                f.write(etag)
+        elif os.path.exists(etag_path):
+            os.remove(etag_path)
+    length = int(r.headers.get('content-length', 0))
+    total = pos + length if length > 0 else 0
+    if HAS_TQDM and total > 0:
+        with open(download_path, mode, buffering=DOWNLOAD_WRITE_BUFFER) as f, tqdm(total=total, initial=pos, unit='B', unit_scale=True, desc='下载进度', ncols=70) as pbar:
+            for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+                pbar.update(len(chunk))
+    else:
+        downloaded = pos
+        last_percent = -1
+        with open(download_path, mode, buffering=DOWNLOAD_WRITE_BUFFER) as f:
+            for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+                if total > 0:
+                    downloaded += len(chunk)
+                    percent = downloaded * 100 // total
+                    # 百分比变化时才刷新，整个下载最多输出约 100 次
+                    if percent != last_percent:
+                        last_percent = percent
+                        print(f"\r下载进度: {percent}%", end='', flush=True)
+        if total > 0:
+            print()
+    # 下载完成后不再需要续传信息
+    if os.path.exists(etag_path):
+        os.remove(etag_path)
 
 def download_file(url_path, download_path):
-    """尝试从官方和镜像列表下载文件，带进度条"""
+    """同时连接官方和所有镜像，从最先响应的下载源下载文件，带进度条"""
     urls_to_try = [mirror.format(path=url_path) for mirror in DOWNLOAD_MIRRORS]
-    for i, full_url in enumerate(urls_to_try):
+    failed = set()
+    # 下载中途失败的下载源，放弃续传、重新完整下载时也不再尝试
+    broken = set()
+    full_retry_done = False
+    while True:
+        remaining = [url for url in urls_to_try if url not in failed]
+        if not remaining:
+            break
+        log.info(f"同时连接 {len(remaining)} 个下载源...")
+        # 上次（或本次前一个下载源）中断时留下了部分文件，尝试续传
+        resume = _resume_headers(download_path)
+        full_url, r = _race_mirrors(remaining, failed, resume)
+        if r is None:
+            if resume is not None and not full_retry_done:
+                # 续传请求全部失败（例如部分文件已失效），丢弃续传信息后重新完整下载，只回退一次：
+                # 否则中途卡住的下载源每次都会重新写入 .etag，与其余连不上的下载源一起无限循环
+                full_retry_done = True
+                os.remove(download_path + ".etag")
+                failed = set(broken)
+                continue
+            break
+        # 下载中途失败时，在剩余的下载源中重新竞速
+        failed.add(full_url)
+        broken.add(full_url)
         try:
-            log.info(f"下载 [{i+1}/{len(urls_to_try)}] {full_url}")
-            headers = {}
-            if "api.github.com" in full_url:
-                headers['Accept'] = 'application/octet-stream'
-            with requests.get(full_url, headers=headers, stream=True, timeout=60) as r:
-                r.raise_for_status()
-                total = int(r.headers.get('content-length', 0))
-                if HAS_TQDM and total > 0:
-                    with open(download_path, 'wb') as f, tqdm(total=total, unit='B', unit_scale=True, desc='下载进度', ncols=70) as pbar:
-                        for chunk in r.iter_content(chunk_size=8192):
-                            f.write(chunk)
-                            pbar.update(len(chunk))
-                else:
-                    downloaded = 0
-                    with open(download_path, 'wb') as f:
-                        for chunk in r.iter_content(chunk_size=8192):
-                            f.write(chunk)
-                            if total > 0:
-                                downloaded += len(chunk)
-                                percent = int(downloaded * 100 / total)
-                                print(f"\r下载进度: {percent}%", end='')
-                    if total > 0:
-                        print()
+            log.info(f"从最先响应的下载源下载: {full_url}")
+            with r:
+                _write_response(r, download_path)
             log.info(f"下载成功: {download_path}")
             return True
         except requests.exceptions.RequestException as e:
@@ -80,55 +282,143 @@ def download_file(url_path, download_path):
             log.error(f"下载过程中发生意外错误: {e}")
     return False
 
+# 计算本地文件 CRC32 时复用的读缓冲区（更新在单个线程中进行）
+_CRC_VIEW = memoryview(bytearray(1024 * 1024))
+
+def _same_content(path, zi):
+    """本地文件与 zip 成员大小相同且 CRC32 一致时返回 True"""
+    try:
+        if not os.path.isfile(path) or os.path.getsize(path) != zi.file_size:
+            return False
+        crc = 0
+        view = _CRC_VIEW
+        # 读入预先分配的缓冲区，避免每块都分配新的 bytes 对象；不经过 Python 层缓冲
+        with open(path, 'rb', buffering=0) as f:
+            while True:
+                n = f.readinto(view)
+                if not n:
+                    break
+                crc = zlib.crc32(view[:n], crc)
+        return crc == zi.CRC
+    except OSError:
+        return False
+
+def _prune_stale(target_dir, top, wanted):
+    """删除顶层目录 top 下不在新版本 zip 中的文件和目录（wanted 为 zip 中所有路径的分段元组）"""
+    stack = [(os.path.join(target_dir, top), (top,))]
+    while stack:
+        dir_path, dir_parts = stack.pop()
+        # scandir 的目录项自带类型信息，不需要对每个条目再 stat 一次
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                parts = dir_parts + (entry.name,)
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if parts in wanted:
+                    if is_dir:
+                        stack.append((entry.path, parts))
+                elif is_dir:
+                    # 新版本中整个目录都已不存在
+                    shutil.rmtree(entry.path)
+                else:
+                    os.unlink(entry.path)
+
 def update_files(zip_path, target_dir):
-    """解压并替换文件，带进度条，减少无关细节输出"""
-    temp_extract_dir = os.path.join(target_dir, "_update_temp")
-    if os.path.exists(temp_extract_dir):
-        shutil.rmtree(temp_extract_dir)
-    os.makedirs(temp_extract_dir, exist_ok=True)
+    """从zip中逐个成员流式解压并直接替换文件，带进度条，减少无关细节输出"""
+    # 不随更新替换的顶层文件和目录，在进入成员循环前只计算一次
+    excluded = frozenset({CONFIG_DIR, os.path.basename(zip_path), os.path.basename(VERSION_FILE), "updater.py", "_update_temp", ".git", ".github"})
     try:
-        log.info(f"开始解压 {zip_path} 到 {temp_extract_dir}...")
+        log.info(f"开始从 {zip_path} 更新文件到 {target_dir}...")
         with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            members = zip_ref.namelist()
-            first_member = members[0]
-            root_folder_in_zip = os.path.normpath(first_member).split(os.sep)[0]
+            infos = zip_ref.infolist()
+            # zip 内的路径始终以 / 分隔
+            root_folder_in_zip = infos[0].filename.split('/')[0]
             log.info(f"Zip 包内的根目录: {root_folder_in_zip}")
+            prefix = root_folder_in_zip + '/'
+            if not all(zi.filename.startswith(prefix) or zi.filename == root_folder_in_zip for zi in infos):
+                log.warning(f"Zip 包内的文件不全在根目录 {root_folder_in_zip} 下，直接使用包内路径。")
+                prefix = ''
+
+            # 去掉根目录得到相对路径，并跳过排除项和不安全的路径
+            # 目标路径直接用字符串拼接得到：zip 路径已按 / 拆分校验过，无需逐个成员调用 os.path.join
+            base = os.path.join(target_dir, '')
+            entries = []
+            for zi in infos:
+                rel = zi.filename[len(prefix):].rstrip('/')
+                if not rel:
+                    continue
+                parts = rel.split('/')
+                if parts[0] in excluded:
+                    continue
+                if rel.startswith('/') or '..' in parts:
+                    log.warning(f"跳过不安全的路径: {zi.filename}")
+                    continue
+                dest = base + (rel if os.sep == '/' else rel.replace('/', os.sep))
+                entries.append((zi, parts, dest))
+
+            top_dirs = {parts[0] for zi, parts, _ in entries if len(parts) > 1 or zi.is_dir()}
+            for top in top_dirs:
+                top_path = os.path.join(target_dir, top)
+                # 顶层同名文件被目录取代
+                if os.path.lexists(top_path) and not os.path.isdir(top_path):
+                    os.remove(top_path)
+
             if HAS_TQDM:
-                for member in tqdm(members, desc='解压进度', ncols=70):
-                    zip_ref.extract(member, temp_extract_dir)
+                bar = tqdm(entries, desc='更新进度', ncols=70)
             else:
-                total = len(members)
-                for idx, member in enumerate(members):
-                    zip_ref.extract(member, temp_extract_dir)
-                    print(f"\r解压进度: {int((idx+1)*100/total)}%", end='')
+                bar = entries
+            total = len(entries)
+            skipped = 0
+            last_percent = -1
+            # 本次已确保存在的目录，同一目录下的多个文件只需创建一次
+            made_dirs = set()
+            for idx, (zi, parts, dest) in enumerate(bar):
+                if zi.is_dir():
+                    if os.path.lexists(dest) and not os.path.isdir(dest):
+                        os.remove(dest)
+                    os.makedirs(dest, exist_ok=True)
+                    made_dirs.add(dest)
+                elif _same_content(dest, zi):
+                    # 内容未变化（大小与 CRC32 一致）的文件无需重写
+                    skipped += 1
+                else:
+                    parent = os.path.dirname(dest)
+                    if parent and parent not in made_dirs:
+                        os.makedirs(parent, exist_ok=True)
+                        made_dirs.add(parent)
+                    if os.path.isdir(dest):
+                        # 同名目录被文件取代
+                        shutil.rmtree(dest)
+                    # 从压缩流写入同目录下的临时文件，再用 os.replace 原子替换，
+                    # 中途出错或进程退出时不会留下写了一半的源码文件
+                    tmp_dest = dest + ".update_tmp"
+                    try:
+                        with zip_ref.open(zi) as src, open(tmp_dest, 'wb') as dst:
+                            shutil.copyfileobj(src, dst, 1024 * 1024)
+                        mode = (zi.external_attr >> 16) & 0o777
+                        if mode:
+                            os.chmod(tmp_dest, mode)
+                        os.replace(tmp_dest, dest)
+                    except BaseException:
+                        if os.path.exists(tmp_dest):
+                            os.remove(tmp_dest)
+                        raise
+                if not HAS_TQDM:
+                    percent = (idx + 1) * 100 // total
+                    # 成员很多时每个文件都刷新一次输出代价较高，只在百分比变化时刷新
+                    if percent != last_percent:
+                        last_percent = percent
+                        print(f"\r更新进度: {percent}%", end='', flush=True)
+            if not HAS_TQDM and total:
                 print()
-        log.info("解压完成。")
-        source_dir_to_copy = os.path.join(temp_extract_dir, root_folder_in_zip)
-        if not os.path.isdir(source_dir_to_copy):
-            log.warning(f"未在 {temp_extract_dir} 中找到预期的根目录 {root_folder_in_zip}，尝试直接使用解压目录。")
-            source_dir_to_copy = temp_extract_dir
-        log.info(f"开始更新文件到 {target_dir}...")
-        items = [item for item in os.listdir(source_dir_to_copy)]
-        if HAS_TQDM:
-            bar = tqdm(items, desc='替换进度', ncols=70)
-        else:
-            bar = items
-        for idx, item in enumerate(bar if HAS_TQDM else items):
-            s_item = os.path.join(source_dir_to_copy, item)
-            d_item = os.path.join(target_dir, item)
-            if item == CONFIG_DIR or item in [os.path.basename(zip_path), os.path.basename(VERSION_FILE), "updater.py", "_update_temp", ".git", ".github"]:
-                continue
-            if os.path.isdir(s_item):
-                if os.path.exists(d_item):
-                    shutil.rmtree(d_item)
-                shutil.copytree(s_item, d_item, dirs_exist_ok=True)
-            else:
-                shutil.copy2(s_item, d_item)
-            if not HAS_TQDM:
-                print(f"\r替换进度: {int((idx+1)*100/len(items))}%", end='')
-        if not HAS_TQDM:
-            print()
-        log.info("文件更新完成。")
+
+            # 与整体替换的行为保持一致：清除 zip 中各顶层目录下旧版本遗留、新版本已不存在的文件
+            wanted = set()
+            for zi, parts, _ in entries:
+                for i in range(1, len(parts) + 1):
+                    wanted.add(tuple(parts[:i]))
+            for top in top_dirs:
+                _prune_stale(target_dir, top, wanted)
+        log.info(f"文件更新完成，{skipped} 个未变化的文件已跳过。")
         return True
     except zipfile.BadZipFile:
         log.error(f"解压失败: {zip_path} 不是一个有效的zip文件或已损坏。")
@@ -137,8 +427,6 @@ def update_files(zip_path, target_dir):
         log.error(f"更新文件过程中发生错误: {e}")
         return False
     finally:
-        if os.path.exists(temp_extract_dir):
-            shutil.rmtree(temp_extract_dir)
         if os.path.exists(zip_path):
             try:
                 os.remove(zip_path)
@@ -165,6 +453,10 @@ def check_and_update():
     current_v = get_current_version()
     log.info(f"当前本地版本: {current_v}")
 
+    if _recently_checked(current_v):
+        log.info("最近已检查过更新，当前已是最新版本")
+        return
+
     latest_info = get_latest_release_info()
     if not latest_info:
         return
@@ -176,6 +468,7 @@ def check_and_update():
         
     latest_v = parse_version(latest_v_str)
     log.info(f"最新可用版本: {latest_v}")
+    _record_check(latest_v_str)
 
     if latest_v > current_v:
         log.info(f"✨ 发现新版本 {latest_v}！")
@@ -207,12 +500,8 @@ def check_and_update():
             return
 
         download_target_zip = "_latest_version.zip"
-        
-        # 优先尝试使用 API 直接给的 zipball_url
-        urls_for_download_logic = [DOWNLOAD_MIRRORS[0].format(path=github_path_for_mirrors)] + \
-                                   [mirror.format(path=github_path_for_mirrors) for mirror in DOWNLOAD_MIRRORS[1:]]
-        
-        log.info(f"将尝试从以下源下载 {github_path_for_mirrors}:")
+
+        log.info(f"将从 {len(DOWNLOAD_MIRRORS)} 个下载源下载 {github_path_for_mirrors}")
 
         if download_file(github_path_for_mirrors, download_target_zip):
             if update_files(download_target_zip, "."):